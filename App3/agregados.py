@@ -0,0 +1,235 @@
+"""Agregados precalculados (semanal, mensual y anual) del precio medio.
+
+Por hoja × producto × mercado × periodo se guardan suma, cuenta, mínimo y
+máximo del precio medio. Con eso el promedio, el máximo y el mínimo de
+cualquier conjunto de semanas salen de unas pocas filas (los años y meses
+completos de una vez), sin recorrer la tabla de registros.
+
+Se construyen en la ingesta (``almacen.sincronizar``): los boletines nuevos
+se suman a lo que ya hay y, si uno se modifica o se retira, se reconstruyen
+desde el almacén. Un boletín copiado en dos carpetas cuenta una sola vez.
+
+``Acumulador`` hace lo mismo sobre la marcha para cualquier agrupación:
+pliega los registros lote a lote y solo guarda una fila por clave.
+"""
+import pandas as pd
+import os, json, threading
+from collections import namedtuple
+import logging
+
+from boletines import escribir_atomico, fuentes_unicas
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+RUTA_AGREGADOS = os.path.join(os.environ.get(
+    "SIPSA_ALMACEN", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "almacen")), "agregados")
+RUTA_ESTADO = os.path.join(RUTA_AGREGADOS, "estado.json")
+
+# Nivel -> frecuencia del periodo (la semana es la fecha del boletín)
+NIVELES = {"semanal": None, "mensual": "M", "anual": "Y"}
+CLAVES = ['hoja', 'producto_norm', 'mercado_norm', 'periodo']
+# Columnas del almacén que se necesitan para construirlos
+COLUMNAS = ['hoja', 'producto_norm', 'mercado_norm', 'fecha', 'precio_medio']
+# Resúmenes parciales que junta un Acumulador antes de combinarlos
+MAX_PARCIALES = 16
+
+# Tablas cargadas ({nivel: DataFrame indexado por CLAVES}), su versión y las semanas (fechas de
+# boletín) que cubren; se reemplazan juntas, así quien toma una tupla ve las tres coherentes
+Agregados = namedtuple("Agregados", "version tablas semanas")
+
+_cargados = None
+_bloqueo = threading.Lock()
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def _ruta(nivel):
+    return os.path.join(RUTA_AGREGADOS, f"{nivel}.parquet")
+
+
+def leer_estado():
+    try:
+        with open(RUTA_ESTADO, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _combinar(partes, claves=CLAVES):
+    """Une agregados parciales de las mismas claves"""
+    df = pd.concat(partes, ignore_index=True)
+    return df.groupby(claves, sort=False, observed=True).agg(
+        suma=('suma', 'sum'), cuenta=('cuenta', 'sum'), minimo=('minimo', 'min'), maximo=('maximo', 'max')
+    ).reset_index()
+
+
+def semanales(df):
+    """Agregado semanal de registros del almacén (una semana = un boletín)"""
+    df = df.dropna(subset=['fecha', 'precio_medio'])
+    return df.rename(columns={'fecha': 'periodo'}).groupby(CLAVES, sort=False)['precio_medio'].agg(
+        suma='sum', cuenta='count', minimo='min', maximo='max'
+    ).reset_index()
+
+
+def subir_nivel(semanal, nivel):
+    """Agregado mensual o anual a partir del semanal"""
+    periodo = semanal['periodo'].dt.to_period(NIVELES[nivel]).dt.to_timestamp()
+    return _combinar([semanal.assign(periodo=periodo)])
+
+
+# =========================
+# 🏗️ Construcción
+# =========================
+def actualizar(manifiesto, version, leer, modificados=()):
+    """Pone los agregados al día con el manifiesto.
+
+    ``leer(ruta)`` devuelve los registros (``COLUMNAS``) de un boletín del
+    almacén; ``modificados`` son las rutas recién reingestadas. Si solo hay
+    boletines nuevos se suman a lo existente; si no, se reconstruye todo.
+    """
+    os.makedirs(RUTA_AGREGADOS, exist_ok=True)
+    anteriores = leer_estado().get("fuentes", {})
+    fuentes = fuentes_unicas(r for r, e in manifiesto.items() if e["filas"])
+
+    incremental = (bool(anteriores) and all(os.path.exists(_ruta(n)) for n in NIVELES)
+                   and all(fuentes.get(f) == rel and rel not in modificados for f, rel in anteriores.items()))
+    agregar = [rel for f, rel in fuentes.items() if f not in anteriores] if incremental else list(fuentes.values())
+
+    if agregar:
+        # Un boletín en memoria a la vez: de cada uno solo queda su agregado semanal
+        # (las fuentes tienen fechas distintas, así que los agregados no se cruzan)
+        partes = [semanal for semanal in map(semanales, map(leer, agregar)) if not semanal.empty]
+        semanal = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame(
+            columns=CLAVES + ['suma', 'cuenta', 'minimo', 'maximo'])
+        semanal['periodo'] = pd.to_datetime(semanal['periodo'])
+        nuevas = {"semanal": semanal, "mensual": subir_nivel(semanal, "mensual"),
+                  "anual": subir_nivel(semanal, "anual")}
+
+        for nivel, tabla in nuevas.items():
+            if incremental:
+                previa = pd.read_parquet(_ruta(nivel))
+                # Las semanas nuevas no se cruzan con las existentes; meses y años sí pueden
+                tabla = (pd.concat([previa, tabla], ignore_index=True) if nivel == "semanal"
+                         else _combinar([previa, tabla]))
+            escribir_atomico(_ruta(nivel), lambda t: tabla.to_parquet(t, index=False))
+
+    # El estado va al final: quien lo lea encuentra las tablas ya escritas
+    def escribir(temporal):
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "fuentes": fuentes}, f, indent=1, sort_keys=True)
+    escribir_atomico(RUTA_ESTADO, escribir)
+    logger.info(f"Agregados {'actualizados' if incremental else 'reconstruidos'}: {len(agregar)} boletines")
+
+
+# =========================
+# 🔎 Consultas
+# =========================
+def cargar():
+    """Agregados (tablas indexadas por CLAVES, versión y semanas), o None si no hay; se releen si cambió el estado"""
+    global _cargados
+    version = leer_estado().get("version")
+    if version is None:
+        return None
+    cargados = _cargados
+    if cargados is not None and cargados.version == version:
+        return cargados
+    with _bloqueo:
+        if _cargados is None or _cargados.version != version:
+            tablas = {n: pd.read_parquet(_ruta(n)).set_index(CLAVES).sort_index() for n in NIVELES}
+            semanas = pd.DatetimeIndex(tablas["semanal"].index.get_level_values('periodo').unique()).sort_values()
+            _cargados = Agregados(version, tablas, semanas)
+        return _cargados
+
+
+def periodos_cubiertos(semanas, fechas):
+    """Reparte las semanas pedidas en años y meses completos y semanas sueltas.
+
+    ``semanas`` son las que cubren los agregados. Un año (o mes) se toma
+    entero solo si todas sus semanas con datos están pedidas.
+    """
+    pendientes = semanas.intersection(pd.DatetimeIndex(fechas))
+    periodos = {}
+    for nivel in ("anual", "mensual"):
+        freq = NIVELES[nivel]
+        total = semanas.to_period(freq).value_counts()
+        pedidas = pendientes.to_period(freq)
+        conteo = pedidas.value_counts()
+        completos = conteo.index[conteo.to_numpy() == total.reindex(conteo.index).to_numpy()]
+        periodos[nivel] = completos.to_timestamp()
+        pendientes = pendientes[~pedidas.isin(completos)]
+    periodos["semanal"] = pendientes
+    return periodos
+
+
+def filas_agregadas(hoja, productos, mercados, fechas):
+    """Filas de agregados (de los tres niveles) que cubren esas semanas, o None si no hay agregados"""
+    cargados = cargar()
+    if cargados is None:
+        return None
+
+    filas = []
+    if len(productos) and len(mercados):
+        for nivel, periodos in periodos_cubiertos(cargados.semanas, fechas).items():
+            if len(periodos):
+                claves = pd.MultiIndex.from_product([[hoja], productos, mercados, periodos], names=CLAVES)
+                filas.append(cargados.tablas[nivel].reindex(claves).dropna(subset=['cuenta']))
+    return pd.concat(filas) if filas else cargados.tablas["semanal"].iloc[:0]
+
+
+def resumir(filas):
+    """Promedio, máximo, mínimo y registros a partir de filas de agregados"""
+    if filas is None or filas.empty:
+        return None
+    cuenta = int(filas['cuenta'].sum())
+    return {
+        'promedio': filas['suma'].sum() / cuenta,
+        'maximo': filas['maximo'].max(),
+        'minimo': filas['minimo'].min(),
+        'registros': cuenta
+    }
+
+
+def estadisticas(hoja, productos, mercados, fechas):
+    """Promedio, máximo, mínimo y registros del precio medio de los productos y mercados en esas semanas.
+
+    ``productos`` y ``mercados`` son nombres normalizados; devuelve None si no hay datos.
+    """
+    return resumir(filas_agregadas(hoja, productos, mercados, fechas))
+
+
+# =========================
+# 🌊 Agregación en flujo
+# =========================
+class Acumulador:
+    """Suma, cuenta, mínimo y máximo corrientes de ``valor`` por ``claves``.
+
+    Cada lote que llega con ``agregar`` se resume de inmediato y los resúmenes
+    se combinan cada MAX_PARCIALES lotes: la memoria depende del número de
+    claves distintas, no de los registros vistos.
+    """
+
+    def __init__(self, claves, valor="precio_medio"):
+        self.claves = list(claves)
+        self.valor = valor
+        self._parciales = []
+
+    def agregar(self, df):
+        df = df.dropna(subset=[self.valor])
+        if df.empty:
+            return
+        self._parciales.append(df.groupby(self.claves, sort=False, observed=True)[self.valor].agg(
+            suma='sum', cuenta='count', minimo='min', maximo='max').reset_index())
+        if len(self._parciales) >= MAX_PARCIALES:
+            self._parciales = [_combinar(self._parciales, self.claves)]
+
+    def resultado(self):
+        """DataFrame con las claves y suma, cuenta, minimo, maximo y promedio"""
+        if not self._parciales:
+            return pd.DataFrame(columns=self.claves + ['suma', 'cuenta', 'minimo', 'maximo', 'promedio'])
+        self._parciales = [_combinar(self._parciales, self.claves)]
+        df = self._parciales[0]
+        return df.assign(promedio=df['suma'] / df['cuenta'])
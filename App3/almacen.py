@@ -0,0 +1,597 @@
+"""Almacén columnar (Parquet) de los boletines SIPSA.
+
+Cada libro Excel del histórico se lee una sola vez y se guarda normalizado en
+``datos/almacen``. El manifiesto registra ruta, mtime y tamaño de cada libro
+para volver a leer únicamente los boletines nuevos o modificados.
+
+En memoria la tabla consolidada va en forma compacta (ver CATEGORICAS): las
+consultas filtran sobre códigos y números y solo las filas devueltas vuelven
+a texto, datetime64 y float64.
+
+La ingesta publica además esa tabla como instantánea (``datos/almacen/
+instantaneas``, un .npy por columna). Los workers la abren con memoria
+mapeada: comparten las mismas páginas del sistema operativo, un worker nuevo
+la tiene lista en milisegundos y ``recargar`` cambia a la siguiente de una
+sola vez cuando se publica.
+"""
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os, json, hashlib, shutil, time
+from collections import namedtuple
+from contextlib import contextmanager
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from boletines import (BASE_PATH, COLUMNAS_PRECIO, opciones_hoja, normalizar, extraer_fecha, abrir_libro,
+                       leer_hoja, extraer_registros, listar_boletines, boletines_en_rango, escribir_atomico)
+from paralelo import procesar_archivos
+import agregados
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+RUTA_ALMACEN = os.environ.get(
+    "SIPSA_ALMACEN", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "almacen"))
+RUTA_MANIFIESTO = os.path.join(RUTA_ALMACEN, "manifiesto.json")
+RUTA_PARQUET = os.path.join(RUTA_ALMACEN, "boletines")
+RUTA_BLOQUEO = os.path.join(RUTA_ALMACEN, "ingesta.lock")
+RUTA_INSTANTANEAS = os.path.join(RUTA_ALMACEN, "instantaneas")
+# Puntero a la instantánea publicada: {"version": ..., "carpeta": ...}
+RUTA_INSTANTANEA = os.path.join(RUTA_ALMACEN, "instantanea.json")
+
+# Con SIPSA_INGESTA_EXTERNA=1 las consultas no leen Excel: la ingesta la hace
+# el vigilante (ingesta.py) y aquí solo se lee el manifiesto publicado
+INGESTA_EXTERNA = os.environ.get("SIPSA_INGESTA_EXTERNA") == "1"
+
+# Subir al cambiar la lectura de boletines: fuerza a reingestar todo el histórico
+VERSION_INGESTA = 4
+
+COLUMNAS = ['producto', 'mercado', 'fecha', 'precio_minimo', 'precio_maximo', 'precio_medio',
+            'archivo', 'hoja', 'ruta', 'producto_norm', 'mercado_norm']
+# Filas por lote al recorrer consultas grandes (consultar_grupos)
+FILAS_LOTE = 50000
+
+# Tabla en memoria: los textos (unos cientos de valores distintos) como
+# categorías, la fecha como días desde 1970 (columna ``dia``, int32) y los
+# precios en float32
+CATEGORICAS = ['producto', 'mercado', 'archivo', 'hoja', 'ruta', 'producto_norm', 'mercado_norm']
+SIN_DIA = np.iinfo(np.int32).min
+# Columnas con índice de nombres (posiciones de las filas de cada nombre)
+INDEXADAS = ("producto_norm", "mercado_norm")
+
+# Tabla de una versión del manifiesto con su índice de nombres
+# ({"producto_norm": {nombre: filas}, ...}) y los productos de cada hoja ({hoja: [nombres]})
+Instantanea = namedtuple("Instantanea", "version tabla indice productos_hoja")
+
+# Instantánea vigente en este proceso; se reemplaza entera, nunca por partes
+_vigente = None
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def ruta_relativa(path):
+    return os.path.relpath(path, BASE_PATH).replace(os.sep, "/")
+
+
+def firma(path):
+    estado = os.stat(path)
+    return {"mtime_ns": estado.st_mtime_ns, "tamano": estado.st_size}
+
+
+def _leer_json(ruta):
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def leer_manifiesto():
+    return _leer_json(RUTA_MANIFIESTO)
+
+
+def leer_puntero():
+    """Versión y carpeta de la instantánea publicada ({} si no hay)"""
+    return _leer_json(RUTA_INSTANTANEA)
+
+
+def guardar_manifiesto(manifiesto):
+    def escribir(temporal):
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f, ensure_ascii=False, indent=1, sort_keys=True)
+    escribir_atomico(RUTA_MANIFIESTO, escribir)
+
+
+def version_manifiesto(manifiesto):
+    """Huella del conjunto de boletines (cambia si se agrega o modifica uno)"""
+    contenido = json.dumps({k: [v["mtime_ns"], v["tamano"], v.get("version")] for k, v in manifiesto.items()},
+                           sort_keys=True)
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+
+# =========================
+# 📥 Ingesta
+# =========================
+def parsear_boletin(path):
+    """Lee todas las hojas de opciones_hoja de un libro y las normaliza al esquema del almacén"""
+    hojas = []
+    fecha = extraer_fecha(path)
+    with abrir_libro(path) as libro:
+        for hoja in opciones_hoja:
+            df = leer_hoja(libro, hoja)
+            if df is None or df.empty:
+                continue
+
+            registros = extraer_registros(df, path, fecha)
+            registros["hoja"] = hoja
+            hojas.append(registros)
+
+    if not hojas:
+        return pd.DataFrame(columns=COLUMNAS)
+
+    with metricas.medir("normalizacion"):
+        df = pd.concat(hojas, ignore_index=True)
+        df["fecha"] = pd.to_datetime(df.pop("boletin"), errors="coerce")
+        for col in COLUMNAS_PRECIO:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float64")
+        df["ruta"] = ruta_relativa(path)
+
+        # Nombres sin tildes ni mayúsculas, calculados una vez por valor distinto
+        for col in ("producto", "mercado"):
+            df[f"{col}_norm"] = df[col].map({v: normalizar(v) for v in df[col].unique()})
+        return df[COLUMNAS]
+
+
+def _pendientes(manifiesto, archivos):
+    """Libros nuevos, modificados o leídos con otra versión de la ingesta"""
+    pendientes = []
+    for path in archivos:
+        entrada = manifiesto.get(ruta_relativa(path))
+        actual = firma(path)
+        if (entrada is None or entrada["mtime_ns"] != actual["mtime_ns"] or entrada["tamano"] != actual["tamano"]
+                or entrada.get("version") != VERSION_INGESTA
+                or not os.path.exists(os.path.join(RUTA_PARQUET, entrada["parquet"]))):
+            pendientes.append(path)
+    return pendientes
+
+
+@contextmanager
+def bloqueo_ingesta():
+    """Un solo proceso ingesta a la vez (workers de gunicorn, vigilante, CLI)"""
+    os.makedirs(RUTA_ALMACEN, exist_ok=True)
+    with open(RUTA_BLOQUEO, "a") as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def al_dia(manifiesto):
+    """True si el manifiesto tiene todos los boletines del histórico: ninguno nuevo, modificado ni borrado"""
+    archivos = listar_boletines()
+    return not _pendientes(manifiesto, archivos) and {ruta_relativa(p) for p in archivos}.issuperset(manifiesto)
+
+
+def sincronizar(archivos=None):
+    """Lleva al almacén los boletines nuevos o modificados y devuelve el manifiesto.
+
+    Los boletines pendientes se leen en paralelo (ver ``paralelo.TRABAJADORES``).
+    """
+    os.makedirs(RUTA_PARQUET, exist_ok=True)
+    if archivos is None:
+        archivos = listar_boletines()
+
+    manifiesto = leer_manifiesto()
+    existentes = {ruta_relativa(p) for p in listar_boletines()}
+    version = version_manifiesto(manifiesto)
+    if (not _pendientes(manifiesto, archivos) and existentes.issuperset(manifiesto)
+            and agregados.leer_estado().get("version") == version and leer_puntero().get("version") == version):
+        return manifiesto
+
+    with bloqueo_ingesta():
+        # Otro proceso pudo haber ingestado mientras se esperaba el bloqueo
+        manifiesto = leer_manifiesto()
+        pendientes = _pendientes(manifiesto, archivos)
+
+        for path, df, error in procesar_archivos(parsear_boletin, pendientes, desc="Ingestando boletines"):
+            rel = ruta_relativa(path)
+            if error:
+                df = pd.DataFrame(columns=COLUMNAS)
+
+            nombre = hashlib.sha1(rel.encode("utf-8")).hexdigest()[:16] + ".parquet"
+            escribir_atomico(os.path.join(RUTA_PARQUET, nombre), lambda t: df.to_parquet(t, index=False))
+            manifiesto[rel] = dict(firma(path), parquet=nombre, filas=len(df), version=VERSION_INGESTA)
+
+        # Boletines borrados del histórico
+        borrados = [rel for rel in manifiesto if rel not in existentes]
+        for rel in borrados:
+            del manifiesto[rel]
+
+        # La instantánea y los agregados semanales/mensuales/anuales van antes que el
+        # manifiesto: quien vea el manifiesto nuevo ya encuentra la serie y las estadísticas al día
+        version = version_manifiesto(manifiesto)
+        if leer_puntero().get("version") != version:
+            try:
+                publicar_instantanea(manifiesto)
+            except OSError as e:
+                logger.warning(f"No se pudo publicar la instantánea: {e}")
+
+        if agregados.leer_estado().get("version") != version:
+            agregados.actualizar(manifiesto, version, lambda rel: leer_boletin(manifiesto, rel, agregados.COLUMNAS),
+                                 modificados={ruta_relativa(p) for p in pendientes})
+
+        if pendientes or borrados:
+            guardar_manifiesto(manifiesto)
+            logger.info(f"Almacén actualizado: {len(pendientes)} boletines ingestados, {len(borrados)} retirados")
+    return manifiesto
+
+
+def manifiesto_vigente(archivos=None):
+    """Manifiesto para consultar: sincroniza antes, salvo que la ingesta corra aparte"""
+    with metricas.medir("revision_manifiesto"):
+        if INGESTA_EXTERNA:
+            return leer_manifiesto()
+        return sincronizar(archivos)
+
+
+def leer_boletin(manifiesto, rel, columnas=None):
+    """Registros de un boletín del almacén"""
+    return pd.read_parquet(os.path.join(RUTA_PARQUET, manifiesto[rel]["parquet"]), columns=columnas)
+
+
+def compactar(df):
+    """Pasa una tabla con COLUMNAS a la representación compacta en memoria"""
+    for col in CATEGORICAS:
+        # Códigos en el entero más pequeño que alcance (int8/int16)
+        categorias = df[col].astype("category")
+        df[col] = pd.Categorical.from_codes(categorias.cat.codes, dtype=categorias.dtype)
+    fechas = df.pop("fecha").to_numpy(dtype="datetime64[ns]")
+    dias = fechas.astype("datetime64[D]").astype(np.int64)
+    dias[np.isnat(fechas)] = SIN_DIA
+    df["dia"] = dias.astype(np.int32)
+    for col in COLUMNAS_PRECIO:
+        df[col] = df[col].astype(np.float32)
+    return df
+
+
+def expandir(df):
+    """Vuelve a texto, ``fecha`` (datetime64) y float64 las columnas de una tabla compacta"""
+    columnas = {}
+    for col, valores in df.items():
+        if col == "dia":
+            dias = valores.to_numpy().astype(np.int64)
+            sin_fecha = dias == SIN_DIA
+            fechas = np.where(sin_fecha, 0, dias).astype("datetime64[D]").astype("datetime64[ns]")
+            fechas[sin_fecha] = np.datetime64("NaT")
+            columnas["fecha"] = fechas
+        elif col in CATEGORICAS:
+            columnas[col] = valores.astype(object)
+        elif col in COLUMNAS_PRECIO:
+            columnas[col] = valores.astype(np.float64)
+        else:
+            columnas[col] = valores
+    return pd.DataFrame(columnas, index=df.index)
+
+
+def _dia(fecha):
+    return int(pd.Timestamp(fecha).to_datetime64().astype("datetime64[D]").astype(np.int64))
+
+
+def construir_tabla(manifiesto):
+    """Tabla compacta con todos los boletines del manifiesto, leída del almacén Parquet"""
+    # Los textos se leen ya como diccionario: nunca se crea un objeto str por fila
+    partes = [pq.read_table(os.path.join(RUTA_PARQUET, e["parquet"]), read_dictionary=CATEGORICAS)
+              for e in manifiesto.values() if e["filas"]]
+    if not partes:
+        return compactar(pd.DataFrame(columns=COLUMNAS))
+    return compactar(pa.concat_tables(partes, promote_options="default").unify_dictionaries().to_pandas())
+
+
+def _ordenar_indice(tabla, col):
+    """Posiciones de las filas ordenadas por código de ``col`` y dónde empieza cada código"""
+    codigos = tabla[col].cat.codes.to_numpy()
+    orden = np.argsort(codigos, kind="stable").astype(np.int32)
+    cortes = np.searchsorted(codigos[orden], np.arange(len(tabla[col].cat.categories) + 1))
+    return orden, cortes
+
+
+def _productos_por_hoja(tabla):
+    pares = tabla[["hoja", "producto_norm"]].drop_duplicates()
+    return {hoja: sorted(nombres.astype(str)) for hoja, nombres in
+            pares.groupby("hoja", observed=True)["producto_norm"]}
+
+
+def _instantanea(version, tabla, ordenes, productos_hoja):
+    """Arma la Instantanea; las filas de cada nombre son vistas sobre ``ordenes`` (sin copiarlas)"""
+    indice = {}
+    for col, (orden, cortes) in ordenes.items():
+        categorias = tabla[col].cat.categories
+        indice[col] = {categorias[i]: orden[cortes[i]:cortes[i + 1]]
+                       for i in np.argsort(categorias) if cortes[i + 1] > cortes[i]}
+    return Instantanea(version, tabla, indice, productos_hoja)
+
+
+def publicar_instantanea(manifiesto):
+    """Escribe la tabla compacta del manifiesto como instantánea y la publica.
+
+    Un .npy por columna (las categóricas como códigos, con sus categorías en
+    meta.json) y el índice de nombres ya ordenado. La carpeta se escribe
+    aparte y el puntero se reemplaza al final: nadie ve una instantánea a medias.
+    """
+    version = version_manifiesto(manifiesto)
+    tabla = construir_tabla(manifiesto)
+    carpeta = version[:16]
+    destino = os.path.join(RUTA_INSTANTANEAS, carpeta)
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    shutil.rmtree(temporal, ignore_errors=True)
+    os.makedirs(temporal)
+
+    meta = {"version": version, "filas": len(tabla), "columnas": list(tabla.columns), "categorias": {},
+            "productos_hoja": _productos_por_hoja(tabla)}
+    for col, valores in tabla.items():
+        if col in CATEGORICAS:
+            meta["categorias"][col] = valores.cat.categories.tolist()
+            valores = valores.cat.codes
+        np.save(os.path.join(temporal, f"{col}.npy"), valores.to_numpy())
+    for col in INDEXADAS:
+        orden, cortes = _ordenar_indice(tabla, col)
+        np.save(os.path.join(temporal, f"orden_{col}.npy"), orden)
+        np.save(os.path.join(temporal, f"cortes_{col}.npy"), cortes)
+    with open(os.path.join(temporal, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    shutil.rmtree(destino, ignore_errors=True)
+    os.replace(temporal, destino)
+    anterior = leer_puntero().get("carpeta")
+
+    def escribir(temporal):
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "carpeta": carpeta}, f)
+    escribir_atomico(RUTA_INSTANTANEA, escribir)
+
+    # Se conserva la anterior: un worker pudo leer el puntero viejo justo antes del cambio.
+    # Las más viejas se borran; quien aún las tenga mapeadas no pierde sus páginas (POSIX)
+    for nombre in os.listdir(RUTA_INSTANTANEAS):
+        if nombre not in (carpeta, anterior):
+            shutil.rmtree(os.path.join(RUTA_INSTANTANEAS, nombre), ignore_errors=True)
+    logger.info(f"Instantánea publicada: {carpeta} ({len(tabla)} registros)")
+
+
+def abrir_instantanea(version=None):
+    """Instantánea publicada, con memoria mapeada de solo lectura.
+
+    None si no hay, si es de otra ``version`` o no se puede abrir.
+    """
+    puntero = leer_puntero()
+    if not puntero or (version is not None and puntero["version"] != version):
+        return None
+
+    carpeta = os.path.join(RUTA_INSTANTANEAS, puntero["carpeta"])
+    try:
+        with open(os.path.join(carpeta, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        # Un arreglo vacío no se puede mapear
+        modo = "r" if meta["filas"] else None
+
+        def cargar(nombre):
+            return np.load(os.path.join(carpeta, f"{nombre}.npy"), mmap_mode=modo)
+
+        columnas = {}
+        for col in meta["columnas"]:
+            valores = cargar(col)
+            if col in meta["categorias"]:
+                valores = pd.Categorical.from_codes(valores, dtype=pd.CategoricalDtype(meta["categorias"][col]))
+            columnas[col] = valores
+        # copy=False: las columnas siguen siendo los arreglos mapeados
+        tabla = pd.DataFrame(columnas, copy=False)
+        ordenes = {col: (cargar(f"orden_{col}"), cargar(f"cortes_{col}")) for col in INDEXADAS}
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"No se pudo abrir la instantánea {puntero['carpeta']}: {e}")
+        return None
+    return _instantanea(meta["version"], tabla, ordenes, meta["productos_hoja"])
+
+
+def _reemplazar(datos, origen, inicio):
+    """Cambia la instantánea vigente; las consultas en curso siguen con la que ya tomaron"""
+    global _vigente
+    _vigente = datos
+    metricas.observar("sipsa_etapa_segundos", time.perf_counter() - inicio, etapa="carga_tabla", origen=origen)
+    metricas.fijar("sipsa_almacen_registros", len(datos.tabla))
+    metricas.fijar("sipsa_almacen_bytes", int(datos.tabla.memory_usage(deep=True).sum()))
+    logger.info(f"Almacén cargado ({origen}): {len(datos.tabla)} registros, "
+                f"{datos.tabla.memory_usage(deep=True).sum() / 2 ** 20:.0f} MB")
+
+
+def recargar():
+    """Gancho de recarga: pasa a la instantánea publicada si no es la vigente.
+
+    Devuelve True si cambió. La app lo llama al importarse (un worker nuevo
+    arranca con la tabla ya mapeada) y el vigilante después de cada ingesta;
+    las consultas además comparan la versión del manifiesto en cada llamada.
+    """
+    inicio = time.perf_counter()
+    puntero = leer_puntero()
+    if not puntero or (_vigente is not None and _vigente.version == puntero["version"]):
+        return False
+    datos = abrir_instantanea(puntero["version"])
+    if datos is None:
+        return False
+    _reemplazar(datos, "instantanea", inicio)
+    return True
+
+
+def _cargar(manifiesto=None):
+    """Instantanea del manifiesto: la vigente, la publicada o, si no la hay, una armada en memoria"""
+    if manifiesto is None:
+        manifiesto = leer_manifiesto()
+
+    version = version_manifiesto(manifiesto)
+    datos = _vigente
+    if datos is None or datos.version != version:
+        inicio = time.perf_counter()
+        datos = abrir_instantanea(version)
+        origen = "instantanea"
+        if datos is None:
+            tabla = construir_tabla(manifiesto)
+            datos = _instantanea(version, tabla, {col: _ordenar_indice(tabla, col) for col in INDEXADAS},
+                                 _productos_por_hoja(tabla))
+            origen = "parquet"
+        _reemplazar(datos, origen, inicio)
+    return datos
+
+
+def instantanea_vigente():
+    """Instantánea en uso, sin revisar el manifiesto (la carga si aún no hay ninguna)"""
+    return _vigente or _cargar()
+
+
+def cargar_tabla(manifiesto=None):
+    """Tabla consolidada de precios (compacta, ver CATEGORICAS); se relee solo si el manifiesto cambió"""
+    return _cargar(manifiesto).tabla
+
+
+# =========================
+# 🔎 Consultas
+# =========================
+def buscar_nombres(campo, texto, datos=None):
+    """Nombres normalizados del vocabulario de ``campo`` que contienen el texto buscado.
+
+    ``campo`` es "producto" o "mercado"; el costo depende del tamaño del
+    vocabulario (cientos de nombres), no del número de filas.
+    """
+    buscado = normalizar(texto)
+    return [nombre for nombre in (datos or _vigente).indice[f"{campo}_norm"] if buscado in nombre]
+
+
+def filas_coincidentes(producto_objetivo, ciudad_objetivo, datos=None):
+    """Posiciones (ordenadas) de las filas cuyo producto y mercado coinciden"""
+    datos = datos or _vigente
+    vacio = np.array([], dtype=np.intp)
+    filas_prod = [datos.indice["producto_norm"][n] for n in buscar_nombres("producto", producto_objetivo, datos)]
+    filas_ciud = [datos.indice["mercado_norm"][n] for n in buscar_nombres("mercado", ciudad_objetivo, datos)]
+    if not filas_prod or not filas_ciud:
+        return vacio
+    return np.intersect1d(np.concatenate(filas_prod), np.concatenate(filas_ciud))
+
+
+def productos_hoja(hoja, datos=None):
+    """Nombres normalizados de los productos de una hoja"""
+    return (datos or _vigente).productos_hoja.get(hoja, [])
+
+
+def _codigos(tabla, col, valores):
+    """Códigos de categoría de ``valores`` en una columna de la tabla (-1 si no está)"""
+    return tabla[col].cat.categories.get_indexer(list(valores))
+
+
+def _mascara(tabla, filas, hoja, archivos, desde, hasta):
+    """Cuáles de las posiciones ``filas`` son de la hoja, de esos libros y del rango de fechas.
+
+    Se evalúa sobre los códigos y días de la tabla en esas posiciones, sin copiar registros.
+    """
+    mascara = tabla["hoja"].cat.codes.to_numpy()[filas] == _codigos(tabla, "hoja", [hoja])[0]
+    if archivos is not None:
+        rutas = _codigos(tabla, "ruta", {ruta_relativa(p) for p in archivos})
+        mascara &= np.isin(tabla["ruta"].cat.codes.to_numpy()[filas], rutas[rutas >= 0])
+    if desde is not None or hasta is not None:
+        dias = tabla["dia"].to_numpy()[filas]
+        mascara &= dias != SIN_DIA
+        if desde is not None:
+            mascara &= dias >= _dia(desde)
+        if hasta is not None:
+            mascara &= dias <= _dia(hasta)
+    return mascara
+
+
+def _extraer(df, filas, columnas):
+    """Copia solo las filas y columnas pedidas, con los tipos de siempre (ver ``expandir``)"""
+    columnas = columnas or COLUMNAS
+    fisicas = ["dia" if c == "fecha" else c for c in columnas]
+    return expandir(df.iloc[filas, [df.columns.get_loc(c) for c in fisicas]]).reset_index(drop=True)
+
+
+def consultar(hoja, producto_objetivo, ciudad_objetivo, archivos=None, desde=None, hasta=None, columnas=None):
+    """Registros de una hoja cuyo producto y mercado contienen los textos buscados.
+
+    ``archivos`` limita la consulta a esos libros; ``desde``/``hasta`` filtran
+    por la fecha del boletín, sin importar la carpeta en que esté. Con un rango,
+    los libros fuera de él se descartan por el nombre antes de abrir ninguno.
+    ``columnas`` limita las columnas devueltas (por defecto, COLUMNAS).
+    """
+    if desde is not None or hasta is not None:
+        archivos = boletines_en_rango(desde, hasta, archivos)
+    datos = _cargar(manifiesto_vigente(archivos))
+
+    # Primero se resuelven los nombres en el índice y los filtros se aplican a
+    # esas posiciones; solo al final se copian las filas y columnas que quedan
+    with metricas.medir("consulta_almacen"):
+        filas = filas_coincidentes(producto_objetivo, ciudad_objetivo, datos)
+        return _extraer(datos.tabla, filas[_mascara(datos.tabla, filas, hoja, archivos, desde, hasta)], columnas)
+
+
+def consultar_grupos(hoja, productos, ciudad_objetivo, archivos=None, desde=None, hasta=None, columnas=None):
+    """Registros de varios productos de una hoja, en una sola pasada por la tabla y por lotes.
+
+    ``productos`` son los textos buscados; si está vacío se toman todos los
+    productos de la hoja. Devuelve el dict {grupo: nombres normalizados} de los
+    grupos con algún producto y un iterador de DataFrames de a lo sumo
+    FILAS_LOTE filas, con las ``columnas`` pedidas más ``grupo`` (el texto
+    buscado, o el nombre normalizado con toda la hoja). Quien los recorre
+    puede plegarlos sin tener todos los registros a la vez.
+    """
+    if desde is not None or hasta is not None:
+        archivos = boletines_en_rango(desde, hasta, archivos)
+    datos = _cargar(manifiesto_vigente(archivos))
+
+    with metricas.medir("consulta_almacen"):
+        grupos, filas, etiquetas = _posiciones_grupos(datos, hoja, productos, ciudad_objetivo, archivos, desde,
+                                                      hasta)
+    return grupos, _lotes(datos.tabla, filas, etiquetas, columnas)
+
+
+def _lotes(df, filas, etiquetas, columnas):
+    for inicio in range(0, len(filas), FILAS_LOTE):
+        fin = inicio + FILAS_LOTE
+        yield _extraer(df, filas[inicio:fin], columnas).assign(grupo=etiquetas[inicio:fin])
+
+
+def _posiciones_grupos(datos, hoja, productos, ciudad_objetivo, archivos, desde, hasta):
+    """Grupos, posiciones (en orden de la tabla) y grupo de cada posición"""
+    de_hoja = set(productos_hoja(hoja, datos))
+    if productos:
+        grupos = {p: [n for n in buscar_nombres("producto", p, datos) if n in de_hoja] for p in productos}
+    else:
+        grupos = {n: [n] for n in productos_hoja(hoja, datos)}
+    grupos = {g: nombres for g, nombres in grupos.items() if nombres}
+
+    # Máscara de las filas del mercado buscado, armada una sola vez para todos los grupos
+    en_ciudad = np.zeros(len(datos.tabla), dtype=bool)
+    for nombre in buscar_nombres("mercado", ciudad_objetivo, datos):
+        en_ciudad[datos.indice["mercado_norm"][nombre]] = True
+
+    posiciones, codigos = [np.array([], dtype=np.intp)], [np.array([], dtype=np.intp)]
+    for codigo, nombres in enumerate(grupos.values()):
+        filas = np.concatenate([datos.indice["producto_norm"][n] for n in nombres])
+        filas = filas[en_ciudad[filas]]
+        posiciones.append(filas)
+        codigos.append(np.full(len(filas), codigo, dtype=np.intp))
+
+    filas, codigos = np.concatenate(posiciones), np.concatenate(codigos)
+    orden = np.argsort(filas, kind="stable")
+    filas, codigos = filas[orden], codigos[orden]
+    conservar = _mascara(datos.tabla, filas, hoja, archivos, desde, hasta)
+    etiquetas = np.array(list(grupos), dtype=object)[codigos[conservar]]
+    return grupos, filas[conservar], etiquetas
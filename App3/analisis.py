@@ -0,0 +1,549 @@
+"""Motor de análisis de la app: consultas al almacén, estadísticas y gráficos.
+
+Trae consigo pandas, NumPy, Plotly, statsmodels y el almacén (con su tabla
+mapeada), así que ``app`` lo importa recién en el primer análisis, o en un
+hilo al arrancar con SIPSA_PRECARGA=1, y la página de inicio y ``/salud``
+responden sin esperarlo.
+"""
+import pandas as pd
+import os
+import plotly.graph_objects as go
+import plotly.express as px
+import logging
+
+import agregados
+import almacen
+import cache
+import metricas
+import reduccion
+import sugerencias
+import tendencias
+import trabajos
+from boletines import (BASE_PATH, opciones_hoja, normalizar, fechas_boletin, listar_boletines,
+                       boletines_en_rango)
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+# Subir al cambiar el contenido de los resultados guardados en caché
+VERSION_RESULTADO = 5
+
+# Separador de productos al comparar (algunos nombres SIPSA llevan coma)
+SEPARADOR_PRODUCTOS = ";"
+
+# Columnas que se traen del almacén para una serie (las de /api/series, más la ruta del libro)
+COLUMNAS_SERIE = ['producto', 'mercado', 'fecha', 'precio_minimo', 'precio_maximo', 'precio_medio', 'archivo',
+                  'ruta']
+# Columnas que se pliegan en una comparación
+COLUMNAS_COMPARACION = ['producto', 'mercado', 'fecha', 'precio_medio', 'ruta']
+
+# Ingesta en segundo plano: con SIPSA_VIGILAR=1 (lo fija gunicorn.conf.py) un único vigilante
+# lleva los boletines nuevos al almacén (lo arranca gunicorn.conf.py, o app.py con el servidor
+# de desarrollo) y las solicitudes solo leen el manifiesto publicado (nunca Excel)
+if os.environ.get("SIPSA_VIGILAR") == "1":
+    almacen.INGESTA_EXTERNA = True
+
+# La tabla de precios se abre desde la instantánea publicada (memoria mapeada):
+# todos los workers de gunicorn comparten sus páginas y arrancan sin leer Parquet
+almacen.recargar()
+
+
+# =========================
+# 📊 Análisis
+# =========================
+def boletines_periodo(anio_objetivo, fecha_inicio, fecha_fin):
+    """Boletines del año (carpeta) o del rango de fechas pedido.
+
+    Devuelve {"error": mensaje} o un dict con archivos, periodo, desde y hasta.
+    """
+    if fecha_inicio or fecha_fin:
+        # Rango de fechas sobre todo el histórico, según la fecha de cada boletín
+        desde = pd.Timestamp(fecha_inicio) if fecha_inicio else None
+        hasta = pd.Timestamp(fecha_fin) if fecha_fin else None
+        periodo = f"{fecha_inicio or 'inicio'} a {fecha_fin or 'hoy'}"
+
+        if desde is not None and hasta is not None and desde > hasta:
+            return {"error": f"La fecha inicial {fecha_inicio} es posterior a la final {fecha_fin}"}
+
+        # El catálogo de fechas sale de los nombres de archivo: no se abre ningún libro
+        archivos = boletines_en_rango(desde, hasta)
+
+        if not archivos:
+            return {"error": f"No hay boletines entre {periodo}"}
+    else:
+        desde = hasta = None
+        periodo = anio_objetivo
+        carpeta_base = os.path.join(BASE_PATH, anio_objetivo)
+
+        if not anio_objetivo or not os.path.exists(carpeta_base):
+            return {"error": f"No se encontró la carpeta para el año {anio_objetivo}"}
+
+        archivos = listar_boletines(carpeta_base)
+
+        if not archivos:
+            return {"error": f"No se encontraron archivos Excel en la carpeta {anio_objetivo}"}
+
+    return {"archivos": archivos, "periodo": periodo, "desde": desde, "hasta": hasta}
+
+
+def semanas_boletines(archivos):
+    """Fechas de boletín (fin de semana) de una lista de archivos"""
+    return [pd.Timestamp(f[1]) for f in map(fechas_boletin, archivos) if f is not None]
+
+
+def consultar_serie(anio_objetivo, fecha_inicio, fecha_fin, hoja, producto_objetivo, ciudad_objetivo):
+    """Consulta, limpieza y estadísticas de la serie de precios (sin gráfico).
+
+    Devuelve {"error": mensaje} o un dict con df_final, periodo y stats.
+    """
+    seleccion = boletines_periodo(anio_objetivo, fecha_inicio, fecha_fin)
+    if "error" in seleccion:
+        return seleccion
+    archivos, periodo = seleccion["archivos"], seleccion["periodo"]
+
+    trabajos.avanzar("Consultando el almacén")
+    df_final = almacen.consultar(hoja, producto_objetivo, ciudad_objetivo, archivos,
+                                 desde=seleccion["desde"], hasta=seleccion["hasta"], columnas=COLUMNAS_SERIE)
+
+    if df_final.empty:
+        return {"error": f"No se encontró información de '{producto_objetivo}' en {ciudad_objetivo}."}
+
+    archivos_procesados = df_final['ruta'].nunique()
+
+    # Limpiar datos inválidos
+    with metricas.medir("limpieza"):
+        filas_antes = len(df_final)
+        df_final = df_final.dropna(subset=['fecha'])
+        if 'precio_medio' in df_final.columns:
+            df_final = df_final.dropna(subset=['precio_medio'])
+        filas_despues = len(df_final)
+
+    logger.debug(f"Datos después de limpieza: {filas_despues}/{filas_antes}")
+
+    if df_final.empty:
+        return {"error": "No hay datos válidos después de la limpieza"}
+
+    # Estadísticas para el template: de los agregados precalculados, o de la serie si aún no existen
+    with metricas.medir("estadisticas"):
+        resumen = agregados.estadisticas(hoja, almacen.buscar_nombres("producto", producto_objetivo),
+                                         almacen.buscar_nombres("mercado", ciudad_objetivo),
+                                         semanas_boletines(archivos))
+    if resumen is None:
+        resumen = {'promedio': df_final['precio_medio'].mean(), 'maximo': df_final['precio_medio'].max(),
+                   'minimo': df_final['precio_medio'].min(), 'registros': len(df_final)}
+    stats = {
+        'promedio_anual': resumen['promedio'],
+        'precio_max': resumen['maximo'],
+        'precio_min': resumen['minimo'],
+        'total_archivos': len(archivos),
+        'archivos_procesados': archivos_procesados,
+        'total_registros': resumen['registros']
+    }
+
+    return {"df_final": df_final, "periodo": periodo, "stats": stats}
+
+
+def consultar_comparacion(anio_objetivo, fecha_inicio, fecha_fin, hoja, productos_texto, ciudad_objetivo):
+    """Series y estadísticas de varios productos (o de toda la hoja) en una sola consulta.
+
+    ``productos_texto`` son los productos separados por SEPARADOR_PRODUCTOS;
+    vacío compara todos los productos de la hoja. Devuelve {"error": mensaje}
+    o un dict con series (grupo, fecha y precio_medio promedio de los
+    mercados), periodo, tabla y stats.
+
+    Los registros se pliegan lote a lote en agregados por producto: la memoria
+    depende del número de productos, fechas y mercados, no de los registros.
+    """
+    seleccion = boletines_periodo(anio_objetivo, fecha_inicio, fecha_fin)
+    if "error" in seleccion:
+        return seleccion
+    archivos, periodo = seleccion["archivos"], seleccion["periodo"]
+
+    productos = separar_productos(productos_texto)
+    trabajos.avanzar("Consultando el almacén")
+    grupos, lotes = almacen.consultar_grupos(hoja, productos, ciudad_objetivo, archivos,
+                                             desde=seleccion["desde"], hasta=seleccion["hasta"],
+                                             columnas=COLUMNAS_COMPARACION)
+
+    por_fecha = agregados.Acumulador(['grupo', 'fecha'])
+    por_mercado = agregados.Acumulador(['grupo', 'mercado'])
+    por_boletin = agregados.Acumulador(['grupo', 'ruta'])
+    nombres = {}
+    trabajos.avanzar("Plegando registros")
+    with metricas.medir("plegado"):
+        for lote in lotes:
+            lote = lote.dropna(subset=['fecha', 'precio_medio'])
+            for acumulador in (por_fecha, por_mercado, por_boletin):
+                acumulador.agregar(lote)
+            for grupo, producto in lote.drop_duplicates('grupo')[['grupo', 'producto']].itertuples(index=False):
+                nombres.setdefault(grupo, producto)
+        series = por_fecha.resultado()
+
+    if series.empty:
+        buscado = ", ".join(productos) if productos else opciones_hoja.get(hoja, hoja)
+        return {"error": f"No se encontró información de '{buscado}' en {ciudad_objetivo}."}
+
+    mercados = por_mercado.resultado().groupby('grupo', sort=False).size()
+    boletines = por_boletin.resultado()
+    por_grupo = boletines.groupby('grupo', sort=False).size()
+
+    # Estadísticas de todos los productos con una sola búsqueda en los agregados
+    filas = agregados.filas_agregadas(hoja, sorted({n for nombres in grupos.values() for n in nombres}),
+                                      almacen.buscar_nombres("mercado", ciudad_objetivo), semanas_boletines(archivos))
+    tabla = []
+    for grupo, serie in series.groupby('grupo', sort=False):
+        resumen = None
+        if filas is not None:
+            resumen = agregados.resumir(filas[filas.index.get_level_values('producto_norm').isin(grupos[grupo])])
+        if resumen is None:
+            resumen = agregados.resumir(serie)
+        # Toda la hoja: cada grupo es un producto; se muestra con su nombre original
+        tabla.append({'producto': grupo if productos else nombres[grupo], **resumen,
+                      'mercados': int(mercados[grupo]), 'boletines': int(por_grupo[grupo])})
+
+    if not productos:
+        series['grupo'] = series['grupo'].map(nombres)
+    stats = {
+        'total_archivos': len(archivos),
+        'archivos_procesados': boletines['ruta'].nunique(),
+        'total_registros': int(series['cuenta'].sum())
+    }
+    sin_datos = [p for p in productos if p not in por_grupo.index]
+    # Los que ni siquiera existen en la hoja llevan su "¿Quiso decir...?"
+    sugeridos = {p: sugerir_nombres("producto", p, hoja) for p in sin_datos
+                 if not sugerencias.existe("producto", p, hoja)}
+    return {"series": series[['grupo', 'fecha', 'promedio']].rename(columns={'promedio': 'precio_medio'}),
+            "periodo": periodo, "tabla": tabla, "sin_datos": sin_datos, "sugerencias": sugeridos, "stats": stats}
+
+
+def separar_productos(texto):
+    return [p.strip() for p in texto.split(SEPARADOR_PRODUCTOS) if p.strip()]
+
+
+def sugerir_nombres(campo, buscado, hoja, limite=3):
+    """Nombres (originales) que se parecen a un texto sin coincidencias, para el ¿Quiso decir...?"""
+    return [s["nombre"] for s in sugerencias.sugerir(campo, buscado, hoja, limite=limite)]
+
+
+def validar_busqueda(hoja, producto_objetivo, ciudad_objetivo, comparacion=False):
+    """Revisa contra el vocabulario de la hoja que el producto y el mercado existan.
+
+    Devuelve None, o {"error": mensaje, "campo", "desconocidos": {texto:
+    sugerencias}} cuando la consulta no puede encontrar nada: así un error de
+    tipeo se responde al instante, sin encolar el recorrido del almacén. En
+    una comparación basta con que exista uno de los productos (los demás
+    salen como "sin datos", con sus sugerencias).
+
+    Sin almacén, o con boletines aún por ingestar, no se rechaza nada: el
+    vocabulario puede quedarse corto y la consulta misma sincroniza.
+    """
+    manifiesto = almacen.leer_manifiesto()
+    if not manifiesto or (not almacen.INGESTA_EXTERNA and not almacen.al_dia(manifiesto)):
+        metricas.contar("sipsa_validaciones_total", resultado="omitida")
+        return None
+    # El vocabulario de la versión publicada (la que usará la consulta)
+    almacen.cargar_tabla(manifiesto)
+
+    productos = separar_productos(producto_objetivo) if comparacion else [producto_objetivo]
+    desconocidos = {p: sugerir_nombres("producto", p, hoja) for p in productos
+                    if not sugerencias.existe("producto", p, hoja)}
+    campo = "producto"
+    if len(desconocidos) < len(productos) or not productos:
+        desconocidos, campo = {}, "mercado"
+        if not sugerencias.existe("mercado", ciudad_objetivo, hoja):
+            desconocidos = {ciudad_objetivo: sugerir_nombres("mercado", ciudad_objetivo, hoja)}
+    if not desconocidos:
+        metricas.contar("sipsa_validaciones_total", resultado="aceptada")
+        return None
+
+    metricas.contar("sipsa_validaciones_total", resultado="rechazada", campo=campo)
+    detalle = [f"'{texto}'" + (f" (¿Quiso decir: {', '.join(propuestas)}?)" if propuestas else "")
+               for texto, propuestas in desconocidos.items()]
+    mensaje = f"No se encontró el {campo} {', '.join(detalle)} en la hoja {hoja} - {opciones_hoja.get(hoja, '')}."
+    return {"error": mensaje, "campo": campo, "desconocidos": desconocidos}
+
+
+def validar_peticion(peticion):
+    """``validar_busqueda`` de una petición del formulario"""
+    return validar_busqueda(peticion["hoja"], peticion["producto"], peticion["ciudad"],
+                            peticion["tipo"] == "comparacion")
+
+
+def figura_analisis(df_final, producto_objetivo, ciudad_objetivo, periodo, suavizado=None, ancho=None):
+    """Figura Plotly de la serie limpia: precio medio y tendencia por mercado y promedio del periodo.
+
+    Cada traza se reduce a los puntos que caben en ``ancho`` píxeles (ver
+    reduccion.py); el promedio y las tendencias se calculan con toda la serie.
+    """
+    # ======= Gráfico Mejorado =======
+    fig = go.Figure()
+    colores = px.colors.qualitative.Plotly
+    mercados = df_final['mercado'].unique()
+    color_map = {m: colores[i % len(colores)] for i, m in enumerate(mercados)}
+
+    # Tendencias de todos los mercados de una vez (memorizadas, ver tendencias.py)
+    try:
+        suavizadas = tendencias.tendencias_por_mercado(df_final, normalizar(producto_objetivo), suavizado)
+    except Exception as e:
+        logger.warning(f"Error calculando tendencias: {e}")
+        suavizadas = {}
+
+    for mercado, grupo in df_final.groupby('mercado'):
+        grupo = grupo.sort_values('fecha')
+        fechas, precios = reduccion.reducir(grupo['fecha'].to_numpy(), grupo['precio_medio'].to_numpy(), ancho)
+
+        # Línea de precios medios
+        fig.add_trace(go.Scatter(
+            x=fechas,
+            y=precios,
+            mode='lines+markers',
+            name=f"{mercado}",
+            line=dict(color=color_map[mercado], width=3),
+            marker=dict(size=6),
+            hovertemplate=(
+                    f"<b>{mercado}</b><br>" +
+                    "Fecha: %{x|%d/%m/%Y}<br>" +
+                    "Precio: %{y:,.0f} COP/kg<br>" +
+                    "<extra></extra>"
+            )
+        ))
+
+        # Tendencia suavizada (solo si el mercado tiene suficientes puntos)
+        if mercado in suavizadas:
+            fechas_suav, y_suav = reduccion.reducir(*suavizadas[mercado], ancho)
+            fig.add_trace(go.Scatter(
+                x=fechas_suav,
+                y=y_suav,
+                mode='lines',
+                name=f"Tendencia {mercado}",
+                line=dict(color=color_map[mercado], width=2, dash='dot'),
+                hovertemplate=(
+                        f"<b>Tendencia {mercado}</b><br>" +
+                        "Fecha: %{x|%d/%m/%Y}<br>" +
+                        "Tendencia: %{y:,.0f} COP/kg<br>" +
+                        "<extra></extra>"
+                ),
+                showlegend=True
+            ))
+
+    # Promedio anual global
+    if 'precio_medio' in df_final.columns:
+        promedio_anual = df_final['precio_medio'].mean()
+        fig.add_trace(go.Scatter(
+            x=[df_final['fecha'].min(), df_final['fecha'].max()],
+            y=[promedio_anual, promedio_anual],
+            mode='lines',
+            name=f"Promedio anual: {promedio_anual:,.0f} COP/kg",
+            line=dict(color='black', width=2, dash='dash'),
+            hovertemplate=f'Promedio anual: {promedio_anual:,.0f} COP/kg<extra></extra>'
+        ))
+
+    # Layout responsivo y mejorado - FORMA CORRECTA
+    fig.update_layout(
+        title=dict(
+            text=f"Evolución del precio del {producto_objetivo.title()} en {ciudad_objetivo.title()} ({periodo})",
+            x=0.5,
+            xanchor='center',
+            font=dict(size=20)
+        ),
+        xaxis_title="Fecha del boletín",
+        yaxis_title="Precio (COP/kg)",
+        template="plotly_white",
+        hovermode="x unified",
+        legend=dict(
+            orientation="h",
+            yanchor="bottom",
+            y=1.02,
+            xanchor="right",
+            x=1
+        ),
+        height=600,
+        margin=dict(l=50, r=50, t=80, b=50),
+        # Configuración de ejes DENTRO de update_layout - CORREGIDO
+        xaxis=dict(
+            tickformat="%b %Y",
+            tickangle=45
+        ),
+        yaxis=dict(
+            tickformat=","
+        )
+    )
+
+    return fig
+
+
+@metricas.medir("grafico")
+def construir_grafico(df_final, producto_objetivo, ciudad_objetivo, periodo, suavizado=None, ancho=None):
+    """Gráfico Plotly (HTML sin plotly.js) de la serie limpia"""
+    fig = figura_analisis(df_final, producto_objetivo, ciudad_objetivo, periodo, suavizado, ancho)
+
+    # plotly.js se sirve aparte desde static/ (ver PLOTLY_JS); aquí solo va la figura
+    with metricas.medir("render_plotly"):
+        graph_html = fig.to_html(
+            full_html=False,
+            include_plotlyjs=False,
+            config={
+                'responsive': True,
+                'displayModeBar': True,
+                'displaylogo': False,
+                'modeBarButtonsToRemove': ['pan2d', 'lasso2d', 'select2d']
+            }
+        )
+
+    return graph_html
+
+
+def figura_comparacion(series, titulo, ciudad_objetivo, periodo, ancho=None):
+    """Figura Plotly con una línea por producto (precio medio promedio de los mercados en cada boletín)"""
+    fig = go.Figure()
+    colores = px.colors.qualitative.Plotly
+
+    for i, (grupo, serie) in enumerate(series.groupby('grupo', sort=False)):
+        serie = serie.sort_values('fecha')
+        fechas, precios = reduccion.reducir(serie['fecha'].to_numpy(), serie['precio_medio'].to_numpy(), ancho)
+        fig.add_trace(go.Scatter(
+            x=fechas,
+            y=precios,
+            mode='lines+markers',
+            name=f"{grupo}",
+            line=dict(color=colores[i % len(colores)], width=2),
+            marker=dict(size=5),
+            hovertemplate=(
+                    f"<b>{grupo}</b><br>" +
+                    "Fecha: %{x|%d/%m/%Y}<br>" +
+                    "Precio: %{y:,.0f} COP/kg<br>" +
+                    "<extra></extra>"
+            )
+        ))
+
+    fig.update_layout(
+        title=dict(
+            text=f"Comparación de precios: {titulo} en {ciudad_objetivo.title() or 'todos los mercados'} ({periodo})",
+            x=0.5,
+            xanchor='center',
+            font=dict(size=20)
+        ),
+        xaxis_title="Fecha del boletín",
+        yaxis_title="Precio medio (COP/kg)",
+        template="plotly_white",
+        hovermode="x unified",
+        height=650,
+        margin=dict(l=50, r=50, t=80, b=50),
+        xaxis=dict(tickformat="%b %Y", tickangle=45),
+        yaxis=dict(tickformat=",")
+    )
+
+    return fig
+
+
+@metricas.medir("grafico")
+def construir_grafico_comparacion(series, titulo, ciudad_objetivo, periodo, ancho=None):
+    """Gráfico Plotly (HTML sin plotly.js) de una comparación"""
+    fig = figura_comparacion(series, titulo, ciudad_objetivo, periodo, ancho)
+    with metricas.medir("render_plotly"):
+        return fig.to_html(
+            full_html=False,
+            include_plotlyjs=False,
+            config={'responsive': True, 'displayModeBar': True, 'displaylogo': False}
+        )
+
+
+def ejecutar_comparacion(anio_objetivo, fecha_inicio, fecha_fin, hoja, productos_texto, ciudad_objetivo, ancho=None):
+    """Comparación de productos con gráfico combinado y tabla de estadísticas por producto"""
+    resultado = consultar_comparacion(anio_objetivo, fecha_inicio, fecha_fin, hoja, productos_texto,
+                                      ciudad_objetivo)
+    if "error" not in resultado:
+        trabajos.avanzar("Construyendo el gráfico")
+        titulo = titulo_comparacion(hoja, productos_texto)
+        resultado["grafico"] = construir_grafico_comparacion(resultado["series"], titulo, ciudad_objetivo,
+                                                             resultado["periodo"], ancho)
+    return resultado
+
+
+def titulo_comparacion(hoja, productos_texto):
+    return (", ".join(separar_productos(productos_texto)).title() if productos_texto
+            else opciones_hoja.get(hoja, hoja))
+
+
+def ejecutar_analisis(anio_objetivo, fecha_inicio, fecha_fin, hoja, producto_objetivo, ciudad_objetivo,
+                      suavizado=None, ancho=None):
+    """Consulta, limpieza, gráfico y estadísticas de un análisis.
+
+    Devuelve {"error": mensaje} o un dict con df_final, grafico, periodo y stats.
+    """
+    resultado = consultar_serie(anio_objetivo, fecha_inicio, fecha_fin, hoja, producto_objetivo, ciudad_objetivo)
+    if "error" not in resultado:
+        trabajos.avanzar("Construyendo el gráfico")
+        resultado["grafico"] = construir_grafico(resultado["df_final"], producto_objetivo, ciudad_objetivo,
+                                                 resultado["periodo"], suavizado, ancho)
+    return resultado
+
+
+def resultado_en_cache(funcion, anio_objetivo, fecha_inicio, fecha_fin, hoja, producto_objetivo, ciudad_objetivo,
+                       **opciones):
+    """Resultado de ``funcion`` (consultar_serie o ejecutar_analisis) a través de la caché en disco"""
+    # Misma consulta normalizada sobre el mismo conjunto de boletines -> mismo resultado
+    huella = almacen.version_manifiesto(almacen.manifiesto_vigente())
+    clave = cache.clave_consulta(VERSION_RESULTADO, funcion.__name__, hoja, normalizar(producto_objetivo),
+                                 normalizar(ciudad_objetivo), anio_objetivo, fecha_inicio, fecha_fin, huella,
+                                 sorted(opciones.items()))
+    resultado = cache.obtener(clave)
+    if resultado is None:
+        resultado = funcion(anio_objetivo, fecha_inicio, fecha_fin, hoja, producto_objetivo, ciudad_objetivo,
+                            **opciones)
+        if "error" not in resultado:
+            cache.guardar(clave, resultado)
+    return resultado
+
+
+def clave_peticion(peticion):
+    """Clave de una petición del formulario; las que dan el mismo resultado comparten clave"""
+    return cache.clave_consulta(VERSION_RESULTADO, peticion["tipo"], peticion["hoja"], normalizar(peticion["producto"]),
+                                normalizar(peticion["ciudad"]), peticion["anio"], peticion["fecha_inicio"],
+                                peticion["fecha_fin"], peticion.get("suavizado"), peticion.get("ancho"))
+
+
+def ejecutar_peticion(peticion):
+    """Resultado (a través de la caché) de una petición de análisis o de comparación.
+
+    ``peticion`` tiene tipo (analisis|comparacion), anio, fecha_inicio,
+    fecha_fin, hoja, producto (en una comparación, los productos separados por
+    SEPARADOR_PRODUCTOS), ciudad, ancho del gráfico en píxeles y, en un
+    análisis, suavizado.
+    """
+    if peticion["tipo"] == "comparacion":
+        funcion, opciones = ejecutar_comparacion, {"ancho": peticion.get("ancho")}
+    else:
+        funcion, opciones = ejecutar_analisis, {"suavizado": peticion["suavizado"], "ancho": peticion.get("ancho")}
+    return resultado_en_cache(funcion, peticion["anio"], peticion["fecha_inicio"], peticion["fecha_fin"],
+                              peticion["hoja"], peticion["producto"], peticion["ciudad"], **opciones)
+
+
+def figura_peticion(peticion):
+    """Figura Plotly (sin HTML) de una petición, para exportarla como imagen.
+
+    Devuelve {"error": mensaje} o {"figura": go.Figure}. La consulta pasa por
+    la caché en disco, como la de la página de resultados.
+    """
+    argumentos = (peticion["anio"], peticion["fecha_inicio"], peticion["fecha_fin"], peticion["hoja"],
+                  peticion["producto"], peticion["ciudad"])
+    if peticion["tipo"] == "comparacion":
+        resultado = resultado_en_cache(consultar_comparacion, *argumentos)
+        if "error" in resultado:
+            return resultado
+        titulo = titulo_comparacion(peticion["hoja"], peticion["producto"])
+        return {"figura": figura_comparacion(resultado["series"], titulo, peticion["ciudad"], resultado["periodo"],
+                                             peticion.get("ancho"))}
+
+    resultado = resultado_en_cache(consultar_serie, *argumentos)
+    if "error" in resultado:
+        return resultado
+    return {"figura": figura_analisis(resultado["df_final"], peticion["producto"], peticion["ciudad"],
+                                      resultado["periodo"], peticion["suavizado"], peticion.get("ancho"))}
+
+
+def stats_json(stats):
+    """Estadísticas con tipos de Python (los de NumPy no pasan a JSON)"""
+    return {k: (float(v) if isinstance(v, float) else int(v)) for k, v in stats.items()}
@@ -1,370 +1,489 @@
-from flask import Flask, render_template, request
-import pandas as pd
-import numpy as np
-import os, re, unicodedata
-import plotly.graph_objects as go
-import plotly.express as px
-from statsmodels.nonparametric.smoothers_lowess import lowess
-from tqdm import tqdm
+import time
+
+# Desde aquí se mide el arranque (importaciones incluidas)
+INICIO = time.perf_counter()
+
+from flask import Flask, Response, g, jsonify, redirect, render_template, request, stream_with_context, url_for
+import os
+import json
+import threading
 import logging
 
-# Configurar logging
-logging.basicConfig(level=logging.INFO)
+import imagenes
+import metricas
+import trabajos
+from opciones import opciones_hoja, MOTORES, MOTOR
+
+# Configurar logging (SIPSA_LOG=DEBUG muestra el detalle por archivo y por consulta)
+logging.basicConfig(level=os.environ.get("SIPSA_LOG", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# =========================
-# ⚙️ Configuración
-# =========================
-BASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "SIPSA_Historico")
+# plotly.js local (sin CDN). Lleva la versión en el nombre, así el navegador
+# puede guardarlo en caché sin vencimiento y no viaja en cada respuesta.
+PLOTLY_JS = "plotly-2.24.1.min.js"
+
+# Campos que puede devolver /api/series y tamaño de página
+CAMPOS_API = ['producto', 'mercado', 'fecha', 'precio_minimo', 'precio_maximo', 'precio_medio', 'archivo']
+POR_PAGINA_API = 500
+MAX_POR_PAGINA_API = 10000
+
+# Tamaño por defecto y máximo de /grafico.png (píxeles) y escala máxima
+ANCHO_IMAGEN, ALTO_IMAGEN = 1200, 600
+MAX_LADO_IMAGEN = 4000
+MAX_ESCALA_IMAGEN = 4
+
+# Segundos entre lecturas del estado de un trabajo y duración máxima de cada flujo SSE
+INTERVALO_EVENTOS = 0.5
+DURACION_EVENTOS = 25
 
-opciones_hoja = {
-    "1.1": "Verduras y hortalizas",
-    "1.2": "Frutas frescas",
-    "1.3": "Tubérculos, raíces y plátanos",
-    "1.4": "Granos y cereales",
-    "1.5": "Huevos y lácteos",
-    "1.6": "Carnes",
-    "1.7": "Pescados",
-    "1.8": "Productos procesados",
-    "1.9": "Abastecimiento semanal por grupo de alimentos"
-}
+# El motor de análisis (pandas, Plotly, almacén...) se carga en el primer uso; con
+# SIPSA_PRECARGA=1 (o SIPSA_VIGILAR=1, que lo necesita) se carga en un hilo al arrancar
+PRECARGA = os.environ.get("SIPSA_PRECARGA") == "1" or os.environ.get("SIPSA_VIGILAR") == "1"
+
+_motor = None
+_segundos_motor = None
+_bloqueo_motor = threading.Lock()
 
 
 # =========================
-# 🧩 Funciones auxiliares CORREGIDAS
+# 🧩 Funciones auxiliares
 # =========================
-def normalizar(texto):
-    if not isinstance(texto, str):
-        return ""
-    texto = unicodedata.normalize('NFD', texto)
-    texto = ''.join([c for c in texto if unicodedata.category(c) != 'Mn'])
-    return texto.lower().strip()
-
-
-def extraer_fecha(nombre_archivo):
-    """Función corregida para extraer fechas de archivos SIPSA"""
-    nombre = os.path.basename(nombre_archivo).lower()
-
-    # Mapeo de meses
-    meses = {
-        'ene': '01', 'feb': '02', 'mar': '03', 'abr': '04', 'may': '05', 'jun': '06',
-        'jul': '07', 'ago': '08', 'sep': '09', 'oct': '10', 'nov': '11', 'dic': '12'
+def motor_analisis():
+    """Módulo ``analisis``, importado (y medido) la primera vez que se pide"""
+    global _motor, _segundos_motor
+    if _motor is None:
+        with _bloqueo_motor:
+            if _motor is None:
+                inicio = time.perf_counter()
+                import analisis
+                _segundos_motor = time.perf_counter() - inicio
+                metricas.fijar("sipsa_importacion_segundos", _segundos_motor, modulo="analisis")
+                logger.info(f"Motor de análisis cargado en {_segundos_motor * 1000:.0f} ms")
+                _motor = analisis
+    return _motor
+
+
+def usar_eventos():
+    """True con workers asíncronos (gunicorn.conf.py fija SIPSA_EVENTOS): solo ahí un flujo SSE no retiene un hilo"""
+    return os.environ.get("SIPSA_EVENTOS") == "1"
+
+
+def peticion_formulario(formulario):
+    """Petición de trabajo (dict JSON) con los campos del formulario.
+
+    Varios productos o toda la categoría dan una comparación; si no, un análisis.
+    """
+    motor = motor_analisis()
+    hoja = formulario["hoja"]
+    suavizado = formulario.get("suavizado")
+    if suavizado not in MOTORES:
+        suavizado = MOTOR
+    # Ancho del gráfico en la página (lo envía el formulario): fija cuántos puntos se dibujan
+    try:
+        ancho = motor.reduccion.ancho_grafico(int(formulario.get("ancho") or 0))
+    except ValueError:
+        ancho = motor.reduccion.ancho_grafico(0)
+    peticion = {
+        "tipo": "analisis",
+        "anio": formulario.get("anio", "").strip(),
+        "fecha_inicio": formulario.get("fecha_inicio", "").strip(),
+        "fecha_fin": formulario.get("fecha_fin", "").strip(),
+        "hoja": hoja,
+        "producto": formulario["producto"],
+        "ciudad": formulario["ciudad"],
+        "suavizado": suavizado,
+        "ancho": ancho
     }
 
-    # Patrones para diferentes formatos de archivo SIPSA
-    patrones = [
-        # Formato: anex-SIPSASemanal-02ago08ago-2025.xlsx
-        r'(\d{1,2})([a-z]{3})(\d{1,2})([a-z]{3})-(\d{4})',
-        # Formato: anex-SIPSASemanal-05abr-11abr-2025.xlsx
-        r'(\d{1,2})([a-z]{3})-(\d{1,2})([a-z]{3})-(\d{4})',
-        # Formato: anex-SIPSASemanal-11ene-17ene-2025.xlsx
-        r'(\d{1,2})([a-z]{3})-(\d{1,2})([a-z]{3})-(\d{4})',
-        # Formato simple con solo año
-        r'(\d{4})'
-    ]
-
-    for patron in patrones:
-        m = re.search(patron, nombre)
-        if m:
-            if len(m.groups()) == 5:
-                # Formato con dos fechas: 02ago08ago-2025
-                dia1, mes1, dia2, mes2, anio = m.groups()
-                mes_num = meses.get(mes2.lower(), '01')
-                fecha = f"{anio}-{mes_num}-{dia2.zfill(2)}"
-                logger.info(f"Fecha extraída: {fecha} de {nombre}")
-                return fecha
-            elif len(m.groups()) == 1:
-                # Solo año encontrado
-                anio = m.group(1)
-                fecha = f"{anio}-01-01"
-                logger.info(f"Solo año encontrado: {fecha} de {nombre}")
-                return fecha
-
-    logger.warning(f"No se pudo extraer fecha del archivo: {nombre}")
-    return None
-
-
-def procesar_boletin(path, hoja, producto_objetivo, ciudad_objetivo):
-    df = None
-    for header_row in range(5, 15):
-        try:
-            temp = pd.read_excel(path, sheet_name=hoja, header=header_row)
-            columnas_lower = [str(c).lower() for c in temp.columns]
-            if "producto" in columnas_lower:
-                df = temp
-                logger.info(f"Header encontrado en fila {header_row} para {os.path.basename(path)}")
-                break
-        except Exception:
-            continue
-
-    if df is None:
-        logger.warning(f"No se pudo leer el archivo {path}")
-        return pd.DataFrame()
-
-    df.columns = df.columns.str.strip().str.lower()
-
-    # VERIFICAR COLUMNAS EXISTENTES - DEBUG
-    logger.info(f"Columnas encontradas en {os.path.basename(path)}: {df.columns.tolist()}")
-
-    if "producto" not in df.columns or "mercado mayorista" not in df.columns:
-        logger.warning(f"Columnas necesarias no encontradas en {path}")
-        return pd.DataFrame()
-
-    df["producto_norm"] = df["producto"].apply(normalizar)
-    df["mercado_norm"] = df["mercado mayorista"].apply(normalizar)
-
-    producto_buscado = normalizar(producto_objetivo)
-    ciudad_buscada = normalizar(ciudad_objetivo)
-
-    mask_prod = df["producto_norm"].str.contains(producto_buscado, na=False)
-    mask_ciud = df["mercado_norm"].str.contains(ciudad_buscada, na=False)
-
-    df_filtrado = df[mask_prod & mask_ciud].copy()
-
-    if df_filtrado.empty:
-        logger.info(f"No se encontró '{producto_objetivo}' en '{ciudad_objetivo}' en {os.path.basename(path)}")
-        return pd.DataFrame()
-
-    # RENOMBRAR COLUMNAS - VERSIÓN ROBUSTA
-    # Crear nuevo DataFrame con las columnas que necesitamos
-    datos_procesados = []
-
-    for _, fila in df_filtrado.iterrows():
-        registro = {
-            'producto': fila['producto'],
-            'mercado': fila['mercado mayorista'],  # Usar el nombre original
-            'archivo': os.path.basename(path),
-            'boletin': extraer_fecha(path)
-        }
-
-        # Buscar precios en las columnas disponibles
-        if 'pesos por kilogramo' in df_filtrado.columns:
-            registro['precio_minimo'] = fila['pesos por kilogramo']
-
-        # Buscar columnas unnamed para precios máximo y medio
-        for idx, col in enumerate(df_filtrado.columns):
-            if 'unnamed' in str(col).lower():
-                if idx == 3:  # Columna 3 es precio_maximo
-                    registro['precio_maximo'] = fila[col]
-                elif idx == 4:  # Columna 4 es precio_medio
-                    registro['precio_medio'] = fila[col]
-
-        datos_procesados.append(registro)
-
-    df_final = pd.DataFrame(datos_procesados)
-    logger.info(f"Procesados {len(df_final)} registros con columnas: {df_final.columns.tolist()}")
-
-    return df_final
+    productos = motor.separar_productos(peticion["producto"])
+    if formulario.get("toda_hoja") == "1" or len(productos) > 1:
+        etiqueta = ", ".join(productos) if productos else f"{hoja} - {opciones_hoja.get(hoja, '')}"
+        peticion.update(tipo="comparacion", producto=motor.SEPARADOR_PRODUCTOS.join(productos), etiqueta=etiqueta,
+                        suavizado=None)
+    return peticion
+
+
+def precargar():
+    """Carga el motor y arma el índice de sugerencias antes de la primera solicitud"""
+    motor_analisis().sugerencias.indice()
+
+
+def ejecutar_trabajo(peticion):
+    return motor_analisis().ejecutar_peticion(peticion)
+
+
+def resultado_trabajo(trabajo):
+    """Resultado de un trabajo terminado; si corrió en otro worker, sale de la caché en disco"""
+    resultado = trabajos.resultado(trabajo["id"])
+    if resultado is None:
+        if trabajo["estado"] == "error":
+            return {"error": trabajo["error"]}
+        resultado = ejecutar_trabajo(trabajo["peticion"])
+    return resultado
 
 
 # =========================
 # 🌐 Rutas Flask
 # =========================
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_solicitud = time.perf_counter()
+
+
+@app.after_request
+def registrar_solicitud(response):
+    """Duración y conteo de cada solicitud, por ruta (la regla de Flask, no la URL) y estado"""
+    inicio = g.pop("inicio_solicitud", None)
+    if inicio is not None:
+        ruta = request.url_rule.rule if request.url_rule else "sin_ruta"
+        metricas.observar("sipsa_solicitud_segundos", time.perf_counter() - inicio, ruta=ruta)
+        metricas.contar("sipsa_solicitudes_total", ruta=ruta, estado=response.status_code)
+    return response
+
+
+@app.after_request
+def cache_navegador(response):
+    if request.path.endswith(PLOTLY_JS):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+
+@app.context_processor
+def variables_plantillas():
+    return {"plotly_js": PLOTLY_JS}
+
+
+@app.route("/metrics")
+def metrics():
+    """Métricas del proceso en formato de exposición de Prometheus"""
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/salud")
+def salud():
+    """Chequeo de salud; responde sin cargar el motor de análisis"""
+    return jsonify({
+        "estado": "ok",
+        "arranque_ms": round(ARRANQUE * 1000, 1),
+        "motor_cargado": _motor is not None,
+        "motor_ms": round(_segundos_motor * 1000, 1) if _segundos_motor is not None else None
+    })
+
+
 @app.route("/")
 def index():
-    return render_template("index.html", opciones_hoja=opciones_hoja)
+    return render_template("index.html", opciones_hoja=opciones_hoja, motores=MOTORES, motor=MOTOR)
 
 
 @app.route("/analizar", methods=["POST"])
 def analizar():
-    try:
-        anio_objetivo = request.form["anio"]
-        hoja = request.form["hoja"]
-        producto_objetivo = request.form["producto"]
-        ciudad_objetivo = request.form["ciudad"]
-
-        carpeta_base = os.path.join(BASE_PATH, anio_objetivo)
-
-        if not os.path.exists(carpeta_base):
-            return render_template(
-                "resultados.html",
-                error=f"No se encontró la carpeta para el año {anio_objetivo}",
-                producto=producto_objetivo,
-                ciudad=ciudad_objetivo
-            )
-
-        archivos = [os.path.join(root, f) for root, _, files in os.walk(carpeta_base)
-                    for f in files if f.lower().endswith((".xlsx", ".xls"))]
-
-        if not archivos:
-            return render_template(
-                "resultados.html",
-                error=f"No se encontraron archivos Excel en la carpeta {anio_objetivo}",
-                producto=producto_objetivo,
-                ciudad=ciudad_objetivo
-            )
-
-        dfs = []
-        for path in tqdm(archivos, desc="Procesando archivos", unit="archivo"):
-            df_temp = procesar_boletin(path, hoja, producto_objetivo, ciudad_objetivo)
-            if not df_temp.empty:
-                dfs.append(df_temp)
-
-        if not dfs:
-            return render_template(
-                "resultados.html",
-                error=f"No se encontró información de '{producto_objetivo}' en {ciudad_objetivo}.",
-                producto=producto_objetivo,
-                ciudad=ciudad_objetivo
-            )
-
-        df_final = pd.concat(dfs, ignore_index=True)
-        df_final['fecha'] = pd.to_datetime(df_final['boletin'], errors='coerce')
-
-        # Convertir columnas numéricas
-        for col in ['precio_minimo', 'precio_maximo', 'precio_medio']:
-            if col in df_final.columns:
-                df_final[col] = pd.to_numeric(df_final[col], errors='coerce')
-
-        # Limpiar datos inválidos
-        filas_antes = len(df_final)
-        df_final = df_final.dropna(subset=['fecha'])
-        if 'precio_medio' in df_final.columns:
-            df_final = df_final.dropna(subset=['precio_medio'])
-        filas_despues = len(df_final)
-
-        logger.info(f"Datos después de limpieza: {filas_despues}/{filas_antes}")
-
-        if df_final.empty:
-            return render_template(
-                "resultados.html",
-                error="No hay datos válidos después de la limpieza",
-                producto=producto_objetivo,
-                ciudad=ciudad_objetivo
-            )
-
-        # ======= Gráfico Mejorado =======
-        fig = go.Figure()
-        colores = px.colors.qualitative.Plotly
-        mercados = df_final['mercado'].unique()
-        color_map = {m: colores[i % len(colores)] for i, m in enumerate(mercados)}
-
-        for mercado, grupo in df_final.groupby('mercado'):
-            grupo = grupo.sort_values('fecha')
-
-            # Línea de precios medios
-            fig.add_trace(go.Scatter(
-                x=grupo['fecha'],
-                y=grupo['precio_medio'],
-                mode='lines+markers',
-                name=f"{mercado}",
-                line=dict(color=color_map[mercado], width=3),
-                marker=dict(size=6),
-                hovertemplate=(
-                        f"<b>{mercado}</b><br>" +
-                        "Fecha: %{x|%d/%m/%Y}<br>" +
-                        "Precio: %{y:,.0f} COP/kg<br>" +
-                        "<extra></extra>"
-                )
-            ))
-
-            # Tendencia suavizada - CORREGIDO
-            if len(grupo) > 1:  # Solo calcular tendencia si hay suficientes puntos
-                try:
-                    # Convertir fechas a numérico para lowess
-                    fechas_numeric = pd.to_numeric(grupo['fecha'])
-                    y_suav = lowess(grupo['precio_medio'], fechas_numeric, frac=0.3, return_sorted=False)
-
-                    fig.add_trace(go.Scatter(
-                        x=grupo['fecha'],
-                        y=y_suav,
-                        mode='lines',
-                        name=f"Tendencia {mercado}",
-                        line=dict(color=color_map[mercado], width=2, dash='dot'),
-                        hovertemplate=(
-                                f"<b>Tendencia {mercado}</b><br>" +
-                                "Fecha: %{x|%d/%m/%Y}<br>" +
-                                "Tendencia: %{y:,.0f} COP/kg<br>" +
-                                "<extra></extra>"
-                        ),
-                        showlegend=True
-                    ))
-                except Exception as e:
-                    logger.warning(f"Error calculando tendencia para {mercado}: {e}")
-
-        # Promedio anual global
-        if 'precio_medio' in df_final.columns:
-            promedio_anual = df_final['precio_medio'].mean()
-            fig.add_trace(go.Scatter(
-                x=[df_final['fecha'].min(), df_final['fecha'].max()],
-                y=[promedio_anual, promedio_anual],
-                mode='lines',
-                name=f"Promedio anual: {promedio_anual:,.0f} COP/kg",
-                line=dict(color='black', width=2, dash='dash'),
-                hovertemplate=f'Promedio anual: {promedio_anual:,.0f} COP/kg<extra></extra>'
-            ))
-
-        # Layout responsivo y mejorado - FORMA CORRECTA
-        fig.update_layout(
-            title=dict(
-                text=f"Evolución del precio del {producto_objetivo.title()} en {ciudad_objetivo.title()} ({anio_objetivo})",
-                x=0.5,
-                xanchor='center',
-                font=dict(size=20)
-            ),
-            xaxis_title="Fecha del boletín",
-            yaxis_title="Precio (COP/kg)",
-            template="plotly_white",
-            hovermode="x unified",
-            legend=dict(
-                orientation="h",
-                yanchor="bottom",
-                y=1.02,
-                xanchor="right",
-                x=1
-            ),
-            height=600,
-            margin=dict(l=50, r=50, t=80, b=50),
-            # Configuración de ejes DENTRO de update_layout - CORREGIDO
-            xaxis=dict(
-                tickformat="%b %Y",
-                tickangle=45
-            ),
-            yaxis=dict(
-                tickformat=","
-            )
-        )
-
-        graph_html = fig.to_html(
-            full_html=False,
-            include_plotlyjs=True,
-            config={
-                'responsive': True,
-                'displayModeBar': True,
-                'displaylogo': False,
-                'modeBarButtonsToRemove': ['pan2d', 'lasso2d', 'select2d']
-            }
-        )
-
-        # Estadísticas para el template
-        stats = {
-            'promedio_anual': df_final['precio_medio'].mean() if 'precio_medio' in df_final.columns else 0,
-            'precio_max': df_final['precio_medio'].max() if 'precio_medio' in df_final.columns else 0,
-            'precio_min': df_final['precio_medio'].min() if 'precio_medio' in df_final.columns else 0,
-            'total_archivos': len(archivos),
-            'archivos_procesados': len(dfs),
-            'total_registros': len(df_final)
-        }
+    """Envía la consulta como trabajo y responde de inmediato con la página que sigue su avance.
 
+    Con ``Accept: application/json`` responde 202 con el id y las rutas del
+    trabajo en vez de redirigir.
+    """
+    try:
+        peticion = peticion_formulario(request.form)
+        # Un producto o mercado que no existe se responde ya, sin encolar el trabajo
+        invalida = motor_analisis().validar_peticion(peticion)
+        if invalida is not None:
+            if request.accept_mimetypes.best == "application/json":
+                return jsonify(invalida), 422
+            return render_template("resultados.html", error=invalida["error"],
+                                   producto=peticion["producto"], ciudad=peticion["ciudad"])
+        id_trabajo, _ = trabajos.enviar(motor_analisis().clave_peticion(peticion), peticion, ejecutar_trabajo)
+    except Exception as e:
+        logger.error(f"Error en el análisis: {e}")
         return render_template(
             "resultados.html",
-            grafico=graph_html,
-            producto=producto_objetivo,
-            ciudad=ciudad_objetivo,
-            **stats
+            error=f"Error en el procesamiento: {str(e)}",
+            producto=request.form.get("producto", ""),
+            ciudad=request.form.get("ciudad", "")
         )
 
+    destino = url_for("ver_trabajo", id_trabajo=id_trabajo)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify({"id": id_trabajo, "resultado": destino,
+                        "estado": url_for("estado_trabajo", id_trabajo=id_trabajo),
+                        "eventos": url_for("eventos_trabajo", id_trabajo=id_trabajo)}), 202, {"Location": destino}
+    return redirect(destino, code=303)
+
+
+@app.route("/trabajos/<id_trabajo>")
+def ver_trabajo(id_trabajo):
+    """Resultados del trabajo si ya terminó; si no, la página que muestra su avance"""
+    trabajo = trabajos.estado(id_trabajo)
+    if trabajo is None:
+        return render_template("resultados.html", error="La consulta no existe o ya venció; vuelva a enviarla.",
+                               producto="", ciudad=""), 404
+    if trabajo["estado"] in trabajos.ACTIVOS:
+        return render_template("trabajo.html", trabajo=trabajo, intervalo=INTERVALO_EVENTOS, eventos=usar_eventos())
+
+    peticion = trabajo["peticion"]
+    try:
+        resultado = resultado_trabajo(trabajo)
     except Exception as e:
         logger.error(f"Error en el análisis: {e}")
+        resultado = {"error": f"Error en el procesamiento: {str(e)}"}
+    if peticion["tipo"] == "comparacion":
+        return pagina_comparacion(peticion, resultado)
+
+    if "error" in resultado:
         return render_template(
             "resultados.html",
-            error=f"Error en el procesamiento: {str(e)}",
-            producto=request.form.get("producto", ""),
-            ciudad=request.form.get("ciudad", "")
+            error=resultado["error"],
+            producto=peticion["producto"],
+            ciudad=peticion["ciudad"]
         )
 
+    return render_template(
+        "resultados.html",
+        grafico=resultado["grafico"],
+        producto=peticion["producto"],
+        ciudad=peticion["ciudad"],
+        periodo=resultado["periodo"],
+        **resultado["stats"]
+    )
+
+
+def pagina_comparacion(peticion, resultado):
+    """Página de resultados de una comparación"""
+    etiqueta, ciudad_objetivo = peticion["etiqueta"], peticion["ciudad"]
+    if "error" in resultado:
+        return render_template("resultados.html", error=resultado["error"], producto=etiqueta,
+                               ciudad=ciudad_objetivo)
+
+    return render_template(
+        "resultados.html",
+        grafico=resultado["grafico"],
+        tabla=resultado["tabla"],
+        sin_datos=resultado["sin_datos"],
+        sugerencias=resultado.get("sugerencias", {}),
+        producto=etiqueta,
+        ciudad=ciudad_objetivo or "todos los mercados",
+        periodo=resultado["periodo"],
+        **resultado["stats"]
+    )
+
+
+@app.route("/trabajos/<id_trabajo>/estado")
+def estado_trabajo(id_trabajo):
+    """Estado del trabajo en JSON, para sondeo"""
+    trabajo = trabajos.estado(id_trabajo)
+    if trabajo is None:
+        return jsonify({"error": "El trabajo no existe o ya venció"}), 404
+    return jsonify(dict(trabajo, resultado=url_for("ver_trabajo", id_trabajo=id_trabajo)))
+
+
+@app.route("/trabajos/<id_trabajo>/eventos")
+def eventos_trabajo(id_trabajo):
+    """Avance del trabajo como Server-Sent Events.
+
+    Se envía un evento por cada cambio de estado; el flujo se cierra al
+    terminar el trabajo o a los DURACION_EVENTOS segundos (el navegador se
+    reconecta solo), para no retener la conexión indefinidamente. Con workers
+    de hilos (sync, gthread) responde 503: cada flujo ocuparía un hilo y la
+    página sondea /estado en su lugar.
+    """
+    if not usar_eventos():
+        return jsonify({"error": "Eventos no disponibles; consulte /estado"}), 503
+
+    def generar():
+        yield f"retry: {int(INTERVALO_EVENTOS * 1000)}\n\n"
+        anterior, limite = None, time.monotonic() + DURACION_EVENTOS
+        while time.monotonic() < limite:
+            trabajo = trabajos.estado(id_trabajo)
+            if trabajo is None:
+                yield "event: desconocido\ndata: {}\n\n"
+                return
+            datos = json.dumps({k: trabajo[k] for k in ("estado", "etapa", "hechos", "total", "error")})
+            if datos != anterior:
+                yield f"data: {datos}\n\n"
+                anterior = datos
+            if trabajo["estado"] not in trabajos.ACTIVOS:
+                return
+            time.sleep(INTERVALO_EVENTOS)
+
+    return Response(stream_with_context(generar()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/grafico.png")
+def grafico_png():
+    """Gráfico de un análisis o de una comparación como PNG, para incrustarlo en informes y correos.
+
+    Parámetros: los del formulario (hoja, producto, ciudad, anio o
+    fecha_inicio/fecha_fin, suavizado, toda_hoja) y ancho, alto y escala.
+    """
+    params = request.args
+    faltantes = [p for p in ("hoja", "ciudad") if not params.get(p, "").strip()]
+    if not params.get("producto", "").strip() and params.get("toda_hoja") != "1":
+        faltantes.append("producto")
+    if faltantes:
+        return jsonify({"error": f"Faltan parámetros: {', '.join(faltantes)}"}), 400
+
+    try:
+        ancho = int(params.get("ancho", ANCHO_IMAGEN))
+        alto = int(params.get("alto", ALTO_IMAGEN))
+        escala = float(params.get("escala", 1))
+    except ValueError:
+        return jsonify({"error": "ancho y alto deben ser enteros y escala un número"}), 400
+    if not (0 < ancho <= MAX_LADO_IMAGEN and 0 < alto <= MAX_LADO_IMAGEN and 0 < escala <= MAX_ESCALA_IMAGEN):
+        return jsonify({"error": f"ancho y alto van de 1 a {MAX_LADO_IMAGEN} y escala hasta {MAX_ESCALA_IMAGEN}"}), 400
+
+    try:
+        peticion = peticion_formulario({"producto": "", **params.to_dict()})
+        figura = motor_analisis().validar_peticion(peticion) or motor_analisis().figura_peticion(peticion)
+        if "error" in figura:
+            return jsonify({"error": figura["error"]}), 404
+        imagen = imagenes.exportar(figura["figura"], "png", ancho, alto, escala)
+    except imagenes.ExportacionNoDisponible as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        logger.error(f"Error exportando el gráfico: {e}")
+        return jsonify({"error": f"Error en el procesamiento: {str(e)}"}), 500
+
+    respuesta = Response(imagen, mimetype="image/png")
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = 3600
+    return respuesta
+
+
+@app.route("/autocompletar")
+def autocompletar():
+    """Sugerencias de productos o mercados de una hoja para el texto escrito (por prefijo o aproximadas).
+
+    Parámetros: campo (producto|mercado), q, hoja (vacía = todas las hojas)
+    y limite. ``existe`` dice si una consulta con ese texto encontraría algo.
+    """
+    params = request.args
+    campo = params.get("campo", "producto")
+    if campo not in ("producto", "mercado"):
+        return jsonify({"error": f"Campo no válido: {campo}"}), 400
+    motor = motor_analisis()
+    try:
+        limite = int(params.get("limite", motor.sugerencias.LIMITE))
+    except ValueError:
+        return jsonify({"error": "limite debe ser un entero"}), 400
+
+    texto = params.get("q", "")
+    hoja = params.get("hoja", "").strip() or None
+    respuesta = jsonify({
+        "campo": campo,
+        "hoja": hoja,
+        "q": texto,
+        "existe": motor.sugerencias.existe(campo, texto, hoja),
+        "sugerencias": motor.sugerencias.sugerir(campo, texto, hoja, limite)
+    })
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = 300
+    return respuesta
+
+
+@app.route("/api/series", methods=["GET", "POST"])
+def api_series():
+    """Serie limpia y estadísticas en JSON (paginado) o CSV (en streaming).
+
+    Parámetros: hoja, producto, ciudad, anio o fecha_inicio/fecha_fin,
+    formato (json|csv), campos (separados por coma), pagina y por_pagina.
+    """
+    params = request.values
+    faltantes = [p for p in ("hoja", "producto", "ciudad") if not params.get(p, "").strip()]
+    if faltantes:
+        return jsonify({"error": f"Faltan parámetros: {', '.join(faltantes)}"}), 400
+
+    campos = [c.strip() for c in params.get("campos", "").split(",") if c.strip()] or CAMPOS_API
+    invalidos = [c for c in campos if c not in CAMPOS_API]
+    if invalidos:
+        return jsonify({"error": f"Campos no válidos: {', '.join(invalidos)}", "campos": CAMPOS_API}), 400
+
+    formato = params.get("formato", "json").lower()
+    if formato not in ("json", "csv"):
+        return jsonify({"error": f"Formato no válido: {formato}"}), 400
+
+    try:
+        pagina = max(1, int(params.get("pagina", 1)))
+        # CSV completo por defecto; JSON en páginas de POR_PAGINA_API registros
+        por_pagina = int(params.get("por_pagina", 0 if formato == "csv" else POR_PAGINA_API))
+        por_pagina = min(max(0, por_pagina), MAX_POR_PAGINA_API)
+    except ValueError:
+        return jsonify({"error": "pagina y por_pagina deben ser enteros"}), 400
+
+    hoja = params["hoja"].strip()
+    producto_objetivo = params["producto"].strip()
+    ciudad_objetivo = params["ciudad"].strip()
+    motor = motor_analisis()
+    try:
+        invalida = motor.validar_busqueda(hoja, producto_objetivo, ciudad_objetivo)
+        if invalida is not None:
+            return jsonify(invalida), 404
+        resultado = motor.resultado_en_cache(motor.consultar_serie, params.get("anio", "").strip(),
+                                             params.get("fecha_inicio", "").strip(),
+                                             params.get("fecha_fin", "").strip(), hoja, producto_objetivo,
+                                             ciudad_objetivo)
+    except Exception as e:
+        logger.error(f"Error en la API: {e}")
+        return jsonify({"error": f"Error en el procesamiento: {str(e)}"}), 500
+
+    if "error" in resultado:
+        return jsonify({"error": resultado["error"]}), 404
+
+    df = resultado["df_final"].sort_values(['fecha', 'mercado', 'producto'], kind='stable')[campos]
+    total = len(df)
+    if por_pagina:
+        df = df.iloc[(pagina - 1) * por_pagina: pagina * por_pagina]
+    if 'fecha' in campos:
+        df = df.assign(fecha=df['fecha'].dt.strftime('%Y-%m-%d'))
+
+    if formato == "csv":
+        def generar():
+            yield ",".join(campos) + "\n"
+            for inicio in range(0, len(df), 1000):
+                yield df.iloc[inicio:inicio + 1000].to_csv(header=False, index=False)
+
+        nombre = f"sipsa_{motor.normalizar(producto_objetivo)}_{motor.normalizar(ciudad_objetivo)}.csv".replace(
+            " ", "_")
+        return Response(stream_with_context(generar()), mimetype="text/csv",
+                        headers={"Content-Disposition": f"attachment; filename={nombre}"})
+
+    stats = motor.stats_json(resultado["stats"])
+    return jsonify({
+        "metadata": {
+            "producto": producto_objetivo,
+            "ciudad": ciudad_objetivo,
+            "periodo": resultado["periodo"],
+            "hoja": hoja,
+            "seccion": opciones_hoja.get(hoja, ""),
+            **stats
+        },
+        "paginacion": {
+            "pagina": pagina,
+            "por_pagina": por_pagina or total,
+            "total_registros": total,
+            "total_paginas": -(-total // por_pagina) if por_pagina else 1
+        },
+        "datos": df.astype(object).where(df.notna(), None).to_dict(orient="records")
+    })
+
+
+# =========================
+# 🚀 Arranque
+# =========================
+ARRANQUE = time.perf_counter() - INICIO
+metricas.fijar("sipsa_arranque_segundos", ARRANQUE)
+logger.info(f"App lista en {ARRANQUE * 1000:.0f} ms; motor de análisis "
+            f"{'cargando en segundo plano' if PRECARGA else 'al primer uso'}")
+if PRECARGA:
+    threading.Thread(target=precargar, name="precarga-sipsa", daemon=True).start()
 
 if __name__ == "__main__":
+    # Con gunicorn el vigilante lo arranca gunicorn.conf.py; aquí, un hilo en este proceso
+    if os.environ.get("SIPSA_VIGILAR") == "1":
+        import ingesta
+        ingesta.iniciar_vigilante(int(os.environ.get("SIPSA_VIGILAR_INTERVALO", ingesta.INTERVALO)))
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,339 @@
+"""Benchmark del pipeline de ingesta y consulta sobre el histórico SIPSA.
+
+Mide cada etapa (fechas, lectura, encabezado, normalización, ingesta, carga,
+consulta, suavizado, gráfico y solicitudes Flask): tiempo mínimo/mediana/máximo
+y memoria pico, sobre el histórico real y sobre históricos sintéticos más
+grandes (el mismo conjunto de libros repetido N veces, cada copia con los años
+corridos para que sus fechas no se repitan). Las etapas de consulta anotan las
+filas que devuelven, así se ve cuánto crece el trabajo con la escala.
+
+Cada escala corre en un proceso aparte con almacén y caché temporales
+(SIPSA_HISTORICO, SIPSA_ALMACEN, SIPSA_CACHE, SIPSA_TRABAJOS_DB), así el
+histórico real, su almacén y sus trabajos no se tocan y la memoria de una
+escala no se mezcla con otra.
+
+Uso:
+    python benchmark.py                                   # histórico completo, escala 1
+    python benchmark.py --archivos 20 --escalas 1,10,100  # 20 libros ×1, ×10 y ×100
+    python benchmark.py --salida bench.json --comparar bench_anterior.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+HISTORICO = os.environ.get("SIPSA_HISTORICO", os.path.join(DIRECTORIO, "datos", "SIPSA_Historico"))
+
+# Consultas representativas: (hoja, producto, ciudad)
+CONSULTAS = [
+    ("1.1", "tomate chonto", "bogota"),
+    ("1.2", "banano", ""),
+    ("1.4", "arroz", "cali"),
+]
+
+# Años en las rutas del histórico (carpeta y nombre del archivo, de donde sale la fecha del boletín); no
+# los seguidos de letras, como en "_2030nov", donde "30nov" es el día y el mes
+PATRON_ANIO = re.compile(r"(?<!\d)20\d\d(?![\da-zA-Z])")
+# Último año que cabe en datetime64[ns] (pandas)
+MAX_ANIO = 2261
+
+
+# =========================
+# ⏱️ Medición
+# =========================
+def rss_pico_mb():
+    """Memoria residente máxima del proceso hasta ahora (MB)"""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def medir(etapa, funcion, repeticiones=3, memoria=True, **extra):
+    """Tiempos de ``funcion`` en varias repeticiones y su memoria pico (tracemalloc) en una pasada aparte"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    pico = None
+    if memoria:
+        tracemalloc.start()
+        funcion()
+        pico = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+
+    resultado = {
+        "etapa": etapa,
+        "repeticiones": repeticiones,
+        "min_s": round(min(tiempos), 4),
+        "mediana_s": round(statistics.median(tiempos), 4),
+        "max_s": round(max(tiempos), 4),
+        "memoria_pico_mb": pico,
+        "rss_pico_mb": rss_pico_mb(),
+        **extra
+    }
+    print(f"   {etapa:<28} {resultado['mediana_s']:>9.4f} s   {pico if pico is not None else '-':>8} MB", flush=True)
+    return resultado
+
+
+# =========================
+# 🔬 Etapas (proceso interno)
+# =========================
+def ejecutar_etapas(repeticiones, muestra):
+    """Corre todas las etapas sobre SIPSA_HISTORICO y devuelve la lista de resultados"""
+    import logging, warnings
+    import boletines, almacen, tendencias, cache
+    import analisis
+    import app as aplicacion
+    # Solo tiempos en la salida: los avisos por libro y de statsmodels se repiten en cada pasada
+    logging.getLogger().setLevel(logging.ERROR)
+    warnings.simplefilter("ignore", RuntimeWarning)
+
+    etapas = []
+    archivos = boletines.listar_boletines()
+    # Solo boletines (los libros sin fecha en el nombre no tienen las hojas de precios)
+    ejemplo = [p for p in archivos if boletines.fechas_boletin(p)][:muestra]
+
+    # Fechas de todo el histórico, sin la memoria de fechas_boletin
+    etapas.append(medir("fechas", lambda: [boletines.fechas_boletin.__wrapped__(p) for p in archivos],
+                        repeticiones, archivos=len(archivos)))
+
+    def leer_crudo():
+        for path in ejemplo:
+            with boletines.abrir_libro(path) as libro:
+                for hoja in boletines.opciones_hoja:
+                    filas = boletines._filas_hoja(libro, hoja)
+                    if filas is not None:
+                        for _ in filas:
+                            pass
+
+    def detectar_encabezados():
+        for path in ejemplo:
+            with boletines.abrir_libro(path) as libro:
+                for hoja in boletines.opciones_hoja:
+                    filas = boletines._filas_hoja(libro, hoja)
+                    if filas is not None:
+                        boletines.buscar_encabezado(filas)
+
+    etapas.append(medir("lectura", leer_crudo, repeticiones, archivos=len(ejemplo)))
+    etapas.append(medir("encabezado", detectar_encabezados, repeticiones, archivos=len(ejemplo)))
+    etapas.append(medir("parseo_boletin", lambda: [almacen.parsear_boletin(p) for p in ejemplo], repeticiones,
+                        archivos=len(ejemplo)))
+
+    parseados = [almacen.parsear_boletin(p) for p in ejemplo]
+    textos = [t for df in parseados for col in ("producto", "mercado") for t in df[col].tolist()]
+    etapas.append(medir("normalizar", lambda: [boletines.normalizar(t) for t in textos], repeticiones,
+                        textos=len(textos)))
+
+    # Ingesta en frío de todo el histórico (una vez: deja el almacén armado)
+    etapas.append(medir("ingesta", almacen.sincronizar, repeticiones=1, memoria=False, archivos=len(archivos)))
+    etapas[-1]["filas"] = len(almacen.cargar_tabla())
+
+    etapas.append(medir("construccion_tabla", lambda: almacen.construir_tabla(almacen.leer_manifiesto()),
+                        repeticiones))
+
+    def cargar_en_frio():
+        almacen._vigente = None
+        almacen.cargar_tabla()
+    etapas.append(medir("carga_tabla", cargar_en_frio, repeticiones))
+    etapas[-1]["registros"] = len(almacen.cargar_tabla())
+
+    etapas.append(medir("consulta", lambda: [almacen.consultar(*c) for c in CONSULTAS], repeticiones,
+                        consultas=len(CONSULTAS), filas=sum(len(almacen.consultar(*c)) for c in CONSULTAS)))
+
+    # La serie más grande de las consultas, limpia como en la app
+    serie = max((almacen.consultar(*c) for c in CONSULTAS), key=len).dropna(subset=["fecha", "precio_medio"])
+    for motor in tendencias.MOTORES:
+        def suavizar(motor=motor):
+            tendencias._memoria.clear()
+            tendencias.tendencias_por_mercado(serie, "benchmark", motor)
+        etapas.append(medir(f"suavizado_{motor}", suavizar, repeticiones, puntos=len(serie),
+                            mercados=int(serie["mercado"].nunique())))
+
+    etapas.append(medir("grafico", lambda: analisis.construir_grafico(serie, "benchmark", "todos", "benchmark"),
+                        repeticiones, puntos=len(serie)))
+
+    # Solicitudes completas por el cliente de pruebas de Flask
+    cliente = aplicacion.app.test_client()
+    hoja, producto, ciudad = CONSULTAS[0]
+    fechas = [f[1] for f in map(boletines.fechas_boletin, archivos) if f is not None]
+    formulario = {"fecha_inicio": min(fechas).isoformat(), "fecha_fin": max(fechas).isoformat(),
+                  "hoja": hoja, "producto": producto, "ciudad": ciudad}
+
+    def solicitud(ruta, datos, frio=False):
+        def enviar():
+            if frio:
+                # Sin resultados ni tendencias guardadas: se recorre todo el camino
+                cache.limpiar()
+                tendencias._memoria.clear()
+            respuesta = cliente.post(ruta, data=datos)
+            if respuesta.status_code == 303:
+                # /analizar responde con un trabajo: se espera a que termine y se pide la página de resultados
+                destino = respuesta.headers["Location"]
+                while cliente.get(f"{destino}/estado").json["estado"] in ("en_cola", "en_curso"):
+                    time.sleep(0.01)
+                respuesta = cliente.get(destino)
+            assert respuesta.status_code == 200, f"{ruta}: HTTP {respuesta.status_code}"
+        return enviar
+
+    # Filas que recorre cada solicitud: las de la serie en el rango y, comparando, las de toda la hoja
+    desde, hasta = min(fechas), max(fechas)
+    filas_serie = len(almacen.consultar(hoja, producto, ciudad, desde=desde, hasta=hasta))
+    filas_hoja = sum(len(lote) for lote in almacen.consultar_grupos(hoja, [], ciudad, desde=desde, hasta=hasta)[1])
+
+    comparacion = dict(formulario, producto="", toda_hoja="1")
+    etapas.append(medir("flask_analizar_frio", solicitud("/analizar", formulario, frio=True), repeticiones,
+                        filas=filas_serie))
+    etapas.append(medir("flask_analizar_caliente", solicitud("/analizar", formulario), repeticiones,
+                        filas=filas_serie))
+    etapas.append(medir("flask_api_series", solicitud("/api/series", formulario), repeticiones, filas=filas_serie))
+    etapas.append(medir("flask_comparar_hoja_frio", solicitud("/analizar", comparacion, frio=True), repeticiones,
+                        filas=filas_hoja))
+    return etapas
+
+
+# =========================
+# 🧪 Históricos sintéticos
+# =========================
+def salto_anios(archivos):
+    """(años que se corre cada copia, último año de los archivos).
+
+    El salto cubre todos los años de los archivos y es múltiplo de 4, para que
+    un boletín del 29 de febrero siga teniendo fecha válida en cada copia.
+    """
+    anios = [int(a) for path in archivos for a in PATRON_ANIO.findall(os.path.relpath(path, HISTORICO))]
+    if not anios:
+        return 4, 0
+    return -(-(max(anios) - min(anios) + 1) // 4) * 4, max(anios)
+
+
+def preparar_historico(destino, archivos, escala):
+    """Histórico con los ``archivos`` repetidos ``escala`` veces (enlaces simbólicos, sin copiar datos).
+
+    Cada copia corre los años de la carpeta y del nombre del archivo, así sus
+    boletines tienen fechas propias: con las mismas fechas, las consultas por
+    rango y los agregados tomarían un solo boletín por fecha y todas las escalas
+    medirían el trabajo de ×1.
+    """
+    salto, _ = salto_anios(archivos)
+    for copia in range(escala):
+        carpeta = destino if copia == 0 else os.path.join(destino, f"sintetico_{copia:03d}")
+        for path in archivos:
+            relativa = PATRON_ANIO.sub(lambda m: str(int(m.group()) + copia * salto), os.path.relpath(path, HISTORICO))
+            nuevo = os.path.join(carpeta, relativa)
+            os.makedirs(os.path.dirname(nuevo), exist_ok=True)
+            os.symlink(path, nuevo)
+
+
+def correr_escala(archivos, escala, repeticiones, muestra):
+    """Corre las etapas en un proceso aparte sobre un histórico temporal de la escala pedida"""
+    temporal = tempfile.mkdtemp(prefix=f"sipsa_bench_x{escala}_")
+    try:
+        base = os.path.join(temporal, "SIPSA_Historico")
+        preparar_historico(base, archivos, escala)
+        salida = os.path.join(temporal, "resultado.json")
+        entorno = dict(os.environ, SIPSA_HISTORICO=base, SIPSA_ALMACEN=os.path.join(temporal, "almacen"),
+                       SIPSA_CACHE=os.path.join(temporal, "cache.sqlite"),
+                       SIPSA_TRABAJOS_DB=os.path.join(temporal, "trabajos.sqlite"), SIPSA_VIGILAR="0")
+        print(f"\n📦 Escala ×{escala}: {len(archivos) * escala} archivos", flush=True)
+        subprocess.run([sys.executable, os.path.abspath(__file__), "--interno", "--salida", salida,
+                        "--repeticiones", str(repeticiones), "--muestra", str(muestra)],
+                       env=entorno, cwd=DIRECTORIO, check=True)
+        with open(salida, encoding="utf-8") as f:
+            return {"escala": escala, "archivos": len(archivos) * escala, "etapas": json.load(f)}
+    finally:
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+def entorno_ejecucion():
+    import numpy, pandas
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIRECTORIO, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    from paralelo import TRABAJADORES
+    return {
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "trabajadores": TRABAJADORES,
+        "pandas": pandas.__version__,
+        "numpy": numpy.__version__,
+        "commit": commit
+    }
+
+
+def comparar(actual, anterior):
+    """Imprime la razón actual/anterior de la mediana de cada etapa"""
+    previas = {(e["escala"], x["etapa"]): x["mediana_s"] for e in anterior["escalas"] for x in e["etapas"]}
+    print(f"\n📊 Comparación con {anterior.get('fecha', 'ejecución anterior')} (actual / anterior)")
+    for escala in actual["escalas"]:
+        for etapa in escala["etapas"]:
+            previo = previas.get((escala["escala"], etapa["etapa"]))
+            if previo:
+                razon = etapa["mediana_s"] / previo
+                marca = "⚠️" if razon > 1.2 else "✅" if razon < 0.8 else "  "
+                print(f"   ×{escala['escala']:<4} {etapa['etapa']:<28} {razon:>6.2f}x {marca}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta y consulta SIPSA")
+    parser.add_argument("--archivos", type=int, default=0, help="libros del histórico real a usar (0 = todos)")
+    parser.add_argument("--escalas", default="1", help="repeticiones del histórico, separadas por coma (ej: 1,10,100)")
+    parser.add_argument("--repeticiones", type=int, default=3, help="repeticiones de cada etapa")
+    parser.add_argument("--muestra", type=int, default=5, help="libros para las etapas de lectura y encabezado")
+    parser.add_argument("--salida", help="archivo JSON de resultados")
+    parser.add_argument("--comparar", help="JSON de una ejecución anterior para comparar")
+    parser.add_argument("--interno", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        etapas = ejecutar_etapas(args.repeticiones, args.muestra)
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(etapas, f)
+        return
+
+    from boletines import listar_boletines
+    archivos = listar_boletines(HISTORICO)
+    if args.archivos:
+        archivos = archivos[:args.archivos]
+
+    escalas = [int(e) for e in args.escalas.split(",")]
+    salto, ultimo = salto_anios(archivos)
+    if ultimo + (max(escalas) - 1) * salto > MAX_ANIO:
+        parser.error(f"×{max(escalas)} correría las fechas más allá de {MAX_ANIO}; use menos --archivos o una "
+                     f"escala menor (máximo ×{(MAX_ANIO - ultimo) // salto + 1} con estos archivos)")
+
+    resultado = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "entorno": entorno_ejecucion(),
+        "parametros": vars(args),
+        "escalas": [correr_escala(archivos, e, args.repeticiones, args.muestra) for e in escalas]
+    }
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False, indent=1)
+        print(f"\n💾 Resultados guardados en {args.salida}")
+    else:
+        print(json.dumps(resultado, ensure_ascii=False))
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(resultado, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import pandas as pd
+import os, re, unicodedata
+from contextlib import contextmanager
+from datetime import date
+from functools import lru_cache
+import openpyxl
+import xlrd
+import logging
+
+import metricas
+from opciones import opciones_hoja
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+BASE_PATH = os.environ.get(
+    "SIPSA_HISTORICO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "SIPSA_Historico"))
+
+COLUMNAS_PRECIO = ['precio_minimo', 'precio_maximo', 'precio_medio']
+ETIQUETAS_PRECIO = {'precio_minimo': 'minimo', 'precio_maximo': 'maximo', 'precio_medio': 'medio'}
+
+MESES = {
+    'ene': 1, 'feb': 2, 'mar': 3, 'abr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'ago': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dic': 12
+}
+_MES = "(" + "|".join(MESES) + ")"
+
+# Nombres de boletín presentes en el histórico (en minúsculas)
+# Formato: Sem_01may_2021_07may_2021.xls / Sem_02ene_2021__08ene_2021.xlsx
+PATRON_FECHA_SEM = re.compile(rf"(\d{{1,2}}){_MES}_(\d{{4}})_+(\d{{1,2}}){_MES}_(\d{{4}})")
+# Formato: anex-SIPSASemanal-05abr-11abr-2025.xlsx / anex-SIPSASemanal-02ago08ago-2025.xlsx /
+#          anex_15abr_al_21abr_2023.xlsx
+PATRON_FECHA_ANEX = re.compile(rf"(\d{{1,2}}){_MES}[-_]*(?:al[-_]+)?(\d{{1,2}}){_MES}[-_]+(\d{{4}})")
+
+# Filas iniciales en las que se busca el encabezado "producto"
+FILAS_ENCABEZADO = 20
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def escribir_atomico(destino, escribir):
+    """Escribe en un temporal y lo renombra, para no dejar archivos a medias"""
+    temporal = f"{destino}.{os.getpid()}.tmp"
+    escribir(temporal)
+    os.replace(temporal, destino)
+
+
+def normalizar(texto):
+    if not isinstance(texto, str):
+        return ""
+    texto = unicodedata.normalize('NFD', texto)
+    texto = ''.join([c for c in texto if unicodedata.category(c) != 'Mn'])
+    return texto.lower().strip()
+
+
+@lru_cache(maxsize=None)
+def fechas_boletin(nombre_archivo):
+    """(inicio, fin) de la semana del boletín según el nombre del archivo, o None"""
+    nombre = os.path.basename(nombre_archivo).lower()
+
+    m = PATRON_FECHA_SEM.search(nombre)
+    if m:
+        dia1, mes1, anio1, dia2, mes2, anio2 = m.groups()
+    else:
+        m = PATRON_FECHA_ANEX.search(nombre)
+        if not m:
+            return None
+        dia1, mes1, dia2, mes2, anio2 = m.groups()
+        # Semana que cruza el año (30dic-05ene-2024): el año del nombre es el del final
+        anio1 = int(anio2) - 1 if MESES[mes1] > MESES[mes2] else anio2
+
+    try:
+        return date(int(anio1), MESES[mes1], int(dia1)), date(int(anio2), MESES[mes2], int(dia2))
+    except ValueError:
+        return None
+
+
+def extraer_fecha(nombre_archivo):
+    """Fecha del boletín ('YYYY-MM-DD', último día de la semana), o None si el nombre no se reconoce"""
+    fechas = fechas_boletin(nombre_archivo)
+    if fechas is None:
+        logger.debug(f"No se pudo extraer fecha del archivo: {os.path.basename(nombre_archivo)}")
+        return None
+    return fechas[1].isoformat()
+
+
+def listar_boletines(carpeta=BASE_PATH):
+    """Lista (ordenados) los libros Excel bajo una carpeta del histórico"""
+    return sorted(os.path.join(root, f) for root, _, files in os.walk(carpeta)
+                  for f in files if f.lower().endswith((".xlsx", ".xls")))
+
+
+def catalogo_boletines(archivos=None):
+    """Catálogo {path: (inicio, fin)} de los boletines y lista de archivos sin fecha reconocible"""
+    catalogo, no_reconocidos = {}, []
+    for path in listar_boletines() if archivos is None else archivos:
+        fechas = fechas_boletin(path)
+        if fechas is None:
+            no_reconocidos.append(path)
+        else:
+            catalogo[path] = fechas
+    return catalogo, no_reconocidos
+
+
+def fuentes_unicas(rutas):
+    """{fecha: ruta} con un boletín por fecha; las copias en otra carpeta y los nombres sin fecha se omiten"""
+    fuentes = {}
+    for rel in sorted(rutas):
+        fechas = fechas_boletin(rel)
+        if fechas is not None:
+            fuentes.setdefault(fechas[1].isoformat(), rel)
+    return fuentes
+
+
+def boletines_en_rango(desde=None, hasta=None, archivos=None):
+    """Boletines cuya fecha (fin de semana) está en [desde, hasta], sin abrir ningún libro.
+
+    Un boletín por fecha: la semana que cruza el año está en dos carpetas
+    (30dic-05ene) y se toma una sola copia, la misma que en los agregados.
+    """
+    catalogo, _ = catalogo_boletines(archivos)
+    desde = desde.date() if hasattr(desde, "date") else desde
+    hasta = hasta.date() if hasattr(hasta, "date") else hasta
+    return sorted(path for path in fuentes_unicas(catalogo).values()
+                  if (desde is None or catalogo[path][1] >= desde) and (hasta is None or catalogo[path][1] <= hasta))
+
+
+# =========================
+# 📖 Lectura de boletines
+# =========================
+def _es_xls(path):
+    """True si el archivo es un .xls binario (OLE2); algunos .xls del histórico son en realidad .xlsx"""
+    with open(path, "rb") as f:
+        return f.read(8) == b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+
+@contextmanager
+def abrir_libro(path):
+    """Abre un libro en modo solo lectura (openpyxl para .xlsx, xlrd para .xls)"""
+    if _es_xls(path):
+        with metricas.medir("apertura_libro"):
+            libro = xlrd.open_workbook(path, on_demand=True)
+        try:
+            yield libro
+        finally:
+            libro.release_resources()
+    else:
+        # Con un archivo abierto openpyxl no rechaza los .xlsx guardados como .xls
+        with open(path, "rb") as archivo:
+            with metricas.medir("apertura_libro"):
+                libro = openpyxl.load_workbook(archivo, read_only=True, data_only=True)
+            try:
+                yield libro
+            finally:
+                libro.close()
+
+
+def _filas_hoja(libro, hoja):
+    """Iterador de filas (valores) de una hoja, o None si el libro no la tiene"""
+    if isinstance(libro, xlrd.book.Book):
+        nombres = {n.strip(): n for n in libro.sheet_names()}
+        if hoja not in nombres:
+            return None
+        sheet = libro.sheet_by_name(nombres[hoja])
+        return (sheet.row_values(i) for i in range(sheet.nrows))
+
+    nombres = {n.strip(): n for n in libro.sheetnames}
+    if hoja not in nombres:
+        return None
+    return libro[nombres[hoja]].iter_rows(values_only=True)
+
+
+def _columnas_precio(encabezado, subencabezado):
+    """Posición de las columnas de precio mínimo, máximo y medio"""
+    columnas = {}
+    for fila in (encabezado, subencabezado):
+        for idx, celda in enumerate(fila):
+            texto = normalizar(celda)
+            for col, etiqueta in ETIQUETAS_PRECIO.items():
+                if col not in columnas and texto.startswith("precio") and etiqueta in texto:
+                    columnas[col] = idx
+
+    # Sin subencabezado: las tres columnas a partir de "pesos por kilogramo"
+    celdas = [normalizar(c) for c in encabezado]
+    if len(columnas) < len(ETIQUETAS_PRECIO) and "pesos por kilogramo" in celdas:
+        inicio = celdas.index("pesos por kilogramo")
+        for desplazamiento, col in enumerate(COLUMNAS_PRECIO):
+            columnas.setdefault(col, inicio + desplazamiento)
+    return columnas
+
+
+def buscar_encabezado(filas):
+    """Avanza ``filas`` hasta el encabezado "producto"; devuelve (fila, valores, celdas normalizadas)"""
+    for header_row, fila in enumerate(filas):
+        celdas = [normalizar(c) for c in fila]
+        if "producto" in celdas:
+            return header_row, fila, celdas
+        if header_row >= FILAS_ENCABEZADO:
+            break
+    return None, None, []
+
+
+def leer_hoja(libro, hoja):
+    """Lee una hoja de un boletín en una sola pasada.
+
+    Busca la fila del encabezado "producto" entre las primeras filas, detecta
+    las columnas de precios y arma el DataFrame con las filas ya leídas.
+    ``libro`` puede ser una ruta o un libro abierto con ``abrir_libro``.
+    """
+    if isinstance(libro, (str, os.PathLike)):
+        with abrir_libro(libro) as abierto:
+            return leer_hoja(abierto, hoja)
+
+    filas = _filas_hoja(libro, hoja)
+    if filas is None:
+        logger.debug(f"El libro no tiene la hoja {hoja}")
+        return None
+
+    with metricas.medir("busqueda_encabezado"):
+        header_row, encabezado, celdas = buscar_encabezado(filas)
+    if encabezado is None or "mercado mayorista" not in celdas:
+        logger.debug(f"No se encontró el encabezado de la hoja {hoja}")
+        return None
+
+    logger.debug(f"Header encontrado en fila {header_row} de la hoja {hoja}")
+    with metricas.medir("lectura_filas"):
+        return _leer_filas(filas, encabezado, celdas)
+
+
+def _leer_filas(filas, encabezado, celdas):
+    """DataFrame producto/mercado/precios con las filas que siguen al encabezado"""
+    idx_producto = celdas.index("producto")
+    idx_mercado = celdas.index("mercado mayorista")
+
+    # Las filas restantes se leen una sola vez; la primera suele ser el subencabezado
+    filas = list(filas)
+    columnas = _columnas_precio(encabezado, filas[0] if filas else ())
+    idx_precios = [columnas.get(col) for col in COLUMNAS_PRECIO]
+
+    def celda(fila, idx):
+        return fila[idx] if idx is not None and idx < len(fila) else None
+
+    registros = []
+    for fila in filas:
+        producto, mercado = celda(fila, idx_producto), celda(fila, idx_mercado)
+        # Solo filas de datos: producto y mercado deben ser texto
+        if isinstance(producto, str) and isinstance(mercado, str) and producto.strip() and mercado.strip():
+            registros.append((producto.strip(), mercado.strip(), *(celda(fila, i) for i in idx_precios)))
+
+    return pd.DataFrame(registros, columns=['producto', 'mercado', *COLUMNAS_PRECIO])
+
+
+def extraer_registros(df, path, fecha=None):
+    """Convierte una hoja leída en registros producto/mercado/precios.
+
+    La fecha del boletín es la misma para todas las filas; si no se pasa, se
+    extrae una sola vez del nombre del archivo.
+    """
+    registros = df[['producto', 'mercado', *COLUMNAS_PRECIO]].copy()
+    registros['archivo'] = os.path.basename(path)
+    registros['boletin'] = extraer_fecha(path) if fecha is None else fecha
+    return registros
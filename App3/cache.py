@@ -0,0 +1,112 @@
+"""Caché en disco de resultados de análisis, compartida entre workers de gunicorn.
+
+Los resultados se guardan serializados en SQLite (un archivo, acceso seguro
+entre procesos). Las entradas vencen por antigüedad (TTL) y, si el total
+supera el límite de tamaño, se descartan las usadas hace más tiempo (LRU).
+La clave incluye la huella del conjunto de boletines, así que agregar o
+modificar un libro invalida los resultados anteriores.
+"""
+import os, time, pickle, sqlite3, hashlib, json
+from contextlib import contextmanager
+import logging
+
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+RUTA_CACHE = os.environ.get(
+    "SIPSA_CACHE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "cache", "resultados.sqlite"))
+# Tamaño máximo total de los resultados guardados
+MAX_BYTES = int(float(os.environ.get("SIPSA_CACHE_MB", 256)) * 1024 * 1024)
+# Segundos que vive una entrada; 0 = sin vencimiento
+TTL = int(os.environ.get("SIPSA_CACHE_TTL", 7 * 24 * 3600))
+
+ESQUEMA = ("""CREATE TABLE IF NOT EXISTS resultados (
+                  clave TEXT PRIMARY KEY,
+                  valor BLOB NOT NULL,
+                  tamano INTEGER NOT NULL,
+                  creado REAL NOT NULL,
+                  usado REAL NOT NULL)""",)
+
+
+@contextmanager
+def conectar(ruta, *esquema):
+    """Conexión SQLite de corta vida (WAL, compartida entre procesos) que crea el esquema si falta.
+
+    Confirma la transacción al salir y se cierra; la usan la caché y ``trabajos``.
+    """
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    con = sqlite3.connect(ruta, timeout=30)
+    try:
+        con.execute("PRAGMA journal_mode=WAL")
+        for sentencia in esquema:
+            con.execute(sentencia)
+        with con:
+            yield con
+    finally:
+        con.close()
+
+
+def _conexion():
+    return conectar(RUTA_CACHE, *ESQUEMA)
+
+
+def clave_consulta(*partes):
+    """Clave estable a partir de las partes (ya normalizadas) de una consulta"""
+    return hashlib.sha1(json.dumps(partes, default=str).encode("utf-8")).hexdigest()
+
+
+def obtener(clave):
+    """Resultado guardado para la clave, o None si no existe o venció"""
+    ahora = time.time()
+    try:
+        with _conexion() as con:
+            fila = con.execute("SELECT valor, creado FROM resultados WHERE clave = ?", (clave,)).fetchone()
+            if fila is None:
+                metricas.contar("sipsa_cache_total", resultado="fallo")
+                logger.debug(f"Caché: fallo {clave[:10]}")
+                return None
+            if TTL and ahora - fila[1] > TTL:
+                con.execute("DELETE FROM resultados WHERE clave = ?", (clave,))
+                metricas.contar("sipsa_cache_total", resultado="vencida")
+                logger.debug(f"Caché: vencida {clave[:10]}")
+                return None
+            con.execute("UPDATE resultados SET usado = ? WHERE clave = ?", (ahora, clave))
+        metricas.contar("sipsa_cache_total", resultado="acierto")
+        logger.debug(f"Caché: acierto {clave[:10]}")
+        return pickle.loads(fila[0])
+    except (sqlite3.Error, pickle.UnpicklingError) as e:
+        metricas.contar("sipsa_cache_total", resultado="error")
+        logger.warning(f"No se pudo leer la caché: {e}")
+        return None
+
+
+def guardar(clave, valor):
+    """Guarda un resultado y aplica el vencimiento y el límite de tamaño"""
+    datos = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(datos) > MAX_BYTES:
+        return
+    ahora = time.time()
+    try:
+        with _conexion() as con:
+            con.execute("INSERT OR REPLACE INTO resultados VALUES (?, ?, ?, ?, ?)",
+                        (clave, datos, len(datos), ahora, ahora))
+            if TTL:
+                con.execute("DELETE FROM resultados WHERE creado < ?", (ahora - TTL,))
+            # LRU: se conservan las más recientes mientras quepan en MAX_BYTES
+            con.execute("""DELETE FROM resultados WHERE clave IN (
+                               SELECT clave FROM (
+                                   SELECT clave, SUM(tamano) OVER (ORDER BY usado DESC, clave) AS acumulado
+                                   FROM resultados)
+                               WHERE acumulado > ?)""", (MAX_BYTES,))
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo escribir en la caché: {e}")
+
+
+def limpiar():
+    """Borra todas las entradas"""
+    with _conexion() as con:
+        con.execute("DELETE FROM resultados")
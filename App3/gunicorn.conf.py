@@ -0,0 +1,55 @@
+"""Configuración de gunicorn (el Procfile la pasa con --config).
+
+Bajo gunicorn ninguna solicitud lee Excel: la ingesta es siempre externa
+(SIPSA_INGESTA_EXTERNA=1) y los workers solo leen el manifiesto publicado.
+El proceso maestro arranca un único vigilante de ingesta (``python
+ingesta.py --vigilar``) y lo detiene al salir: un solo proceso sincroniza el
+almacén, sin importar cuántos workers haya ni cuántas veces se reinicien.
+Con SIPSA_VIGILAR=0 no se arranca y la ingesta queda a cargo de un
+``python ingesta.py`` aparte (cron, por ejemplo).
+
+Cada flujo SSE retiene un hilo del worker mientras dura; por eso la página de
+un trabajo sondea el estado y solo usa SSE con workers asíncronos (gevent,
+eventlet, tornado), que cada worker anuncia en SIPSA_EVENTOS al arrancar.
+
+La sincronización dentro de la solicitud queda solo para ``python app.py``.
+"""
+import os
+import subprocess
+import sys
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+# Se leen al cargar esta configuración, en el maestro: los workers los heredan
+os.environ["SIPSA_INGESTA_EXTERNA"] = "1"
+os.environ.setdefault("SIPSA_VIGILAR", "1")
+
+# Clases de worker en que una conexión abierta no ocupa un hilo
+ASINCRONOS = ("gevent", "eventlet", "tornado")
+
+_vigilante = None
+
+
+def when_ready(server):
+    global _vigilante
+    if os.environ.get("SIPSA_VIGILAR") != "1":
+        return
+    comando = [sys.executable, os.path.join(DIRECTORIO, "ingesta.py"), "--vigilar"]
+    if os.environ.get("SIPSA_VIGILAR_INTERVALO"):
+        comando += ["--intervalo", os.environ["SIPSA_VIGILAR_INTERVALO"]]
+    _vigilante = subprocess.Popen(comando, cwd=DIRECTORIO)
+    server.log.info(f"Vigilante de ingesta arrancado (pid {_vigilante.pid})")
+
+
+def post_worker_init(worker):
+    clase = worker.cfg.worker_class_str.lower()
+    os.environ["SIPSA_EVENTOS"] = "1" if any(nombre in clase for nombre in ASINCRONOS) else "0"
+
+
+def on_exit(server):
+    if _vigilante is not None and _vigilante.poll() is None:
+        _vigilante.terminate()
+        try:
+            _vigilante.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _vigilante.kill()
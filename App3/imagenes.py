@@ -0,0 +1,138 @@
+"""Exportación de gráficos Plotly a imagen estática (PNG, SVG...) con kaleido.
+
+Cada renderizador de kaleido es un proceso de Chromium que tarda más de un
+segundo en arrancar; aquí se mantiene un pool de RENDERIZADORES abiertos que
+se prestan de a uno, así una exportación cuesta solo el dibujo y varias
+figuras se dibujan a la vez. Las imágenes se guardan en la caché de
+resultados (``cache``) con la huella de la figura como clave: la misma
+figura con el mismo tamaño no se vuelve a dibujar.
+
+kaleido es opcional: sin él, ``exportar`` lanza ``ExportacionNoDisponible``.
+"""
+import os, queue, threading, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import logging
+
+import cache
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+# Renderizadores abiertos a la vez en cada proceso; cada uno es un Chromium (~100 MB) y dibuja con un núcleo
+RENDERIZADORES = int(os.environ.get("SIPSA_RENDERIZADORES", 0)) or min(4, os.cpu_count() or 1)
+# plotly.js local, el mismo que sirve la app (sin CDN)
+PLOTLY_JS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "plotly-2.24.1.min.js")
+# Subir al cambiar cómo se dibujan las imágenes guardadas en caché
+VERSION_IMAGEN = 1
+
+FORMATOS = {"png": "image/png", "svg": "image/svg+xml", "jpeg": "image/jpeg", "webp": "image/webp",
+            "pdf": "application/pdf"}
+
+_libres = queue.Queue()
+_creados = 0
+_bloqueo = threading.Lock()
+
+
+class ExportacionNoDisponible(RuntimeError):
+    """kaleido no está instalado"""
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def _nuevo_renderizador():
+    try:
+        from kaleido.scopes.plotly import PlotlyScope
+    except ImportError as e:
+        raise ExportacionNoDisponible("La exportación de imágenes requiere kaleido (pip install kaleido)") from e
+    with metricas.medir("arranque_renderizador"):
+        return PlotlyScope(plotlyjs=PLOTLY_JS, mathjax=False)
+
+
+@contextmanager
+def _renderizador():
+    """Presta un renderizador del pool (lo crea si aún no hay RENDERIZADORES; si no, espera uno libre)"""
+    global _creados
+    try:
+        renderizador = _libres.get_nowait()
+    except queue.Empty:
+        with _bloqueo:
+            crear = _creados < RENDERIZADORES
+            if crear:
+                _creados += 1
+        if crear:
+            try:
+                renderizador = _nuevo_renderizador()
+            except Exception:
+                with _bloqueo:
+                    _creados -= 1
+                raise
+        else:
+            renderizador = _libres.get()
+    try:
+        yield renderizador
+    finally:
+        _libres.put(renderizador)
+
+
+def huella(figura, formato, ancho, alto, escala):
+    """Clave de caché de la imagen: contenido de la figura más formato y tamaño"""
+    import plotly.io as pio
+    contenido = pio.to_json(figura, validate=False, engine="json")
+    return cache.clave_consulta("imagen", VERSION_IMAGEN, hashlib.sha1(contenido.encode("utf-8")).hexdigest(),
+                                formato, ancho, alto, escala)
+
+
+# =========================
+# 🖼️ Exportación
+# =========================
+def exportar(figura, formato="png", ancho=None, alto=None, escala=1):
+    """Bytes de la imagen de una figura (go.Figure o dict), de la caché o dibujados con un renderizador del pool.
+
+    ``ancho`` y ``alto`` en píxeles; por defecto, los del layout de la figura.
+    """
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de imagen no válido: {formato}")
+    clave = huella(figura, formato, ancho, alto, escala)
+    imagen = cache.obtener(clave)
+    if imagen is not None:
+        metricas.contar("sipsa_imagenes_total", resultado="cache")
+        return imagen
+
+    with _renderizador() as renderizador:
+        with metricas.medir("exportar_imagen", formato=formato):
+            imagen = renderizador.transform(figura, format=formato, width=ancho, height=alto, scale=escala)
+    metricas.contar("sipsa_imagenes_total", resultado="dibujada")
+    cache.guardar(clave, imagen)
+    return imagen
+
+
+def exportar_varias(figuras, formato="png", ancho=None, alto=None, escala=1):
+    """Imágenes de varias figuras, dibujadas a la vez con todos los renderizadores; en el orden de ``figuras``.
+
+    Devuelve una lista de bytes, o la excepción en lugar de la imagen que no se pudo exportar.
+    """
+    def una(figura):
+        try:
+            return exportar(figura, formato, ancho, alto, escala)
+        except Exception as e:
+            return e
+
+    figuras = list(figuras)
+    if not figuras:
+        return []
+    with ThreadPoolExecutor(max_workers=min(RENDERIZADORES, len(figuras)), thread_name_prefix="imagen-sipsa") as pool:
+        return list(pool.map(una, figuras))
+
+
+def guardar_imagen(figura, salida, **opciones):
+    """Exporta una figura a un archivo; el formato sale de la extensión"""
+    formato = os.path.splitext(salida)[1].lstrip(".").lower() or "png"
+    imagen = exportar(figura, "jpeg" if formato == "jpg" else formato, **opciones)
+    with open(salida, "wb") as f:
+        f.write(imagen)
+    return salida
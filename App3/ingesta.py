@@ -0,0 +1,82 @@
+"""Ingesta incremental de boletines SIPSA al almacén columnar.
+
+Revisa el mtime y tamaño de los libros de ``datos/SIPSA_Historico`` y lleva al
+almacén solo los nuevos o modificados (misma lectura que ``almacen.sincronizar``).
+El manifiesto se publica de forma atómica, así los workers de la app ven el
+almacén anterior o el nuevo, nunca uno a medias.
+
+Uso:
+    python ingesta.py                  # una pasada y termina
+    python ingesta.py --vigilar        # revisa cada --intervalo segundos
+
+En la app hay un solo vigilante: bajo gunicorn, gunicorn.conf.py lo lanza
+como este proceso (``--vigilar``) desde el maestro (salvo SIPSA_VIGILAR=0), y
+``python app.py`` con SIPSA_VIGILAR=1 lo corre en un hilo.
+"""
+import argparse
+import threading
+import time
+import logging
+
+import almacen
+from boletines import catalogo_boletines
+
+logger = logging.getLogger(__name__)
+
+INTERVALO = 60
+
+
+def ingestar():
+    """Una pasada de ingesta; devuelve True si el almacén cambió"""
+    antes = almacen.version_manifiesto(almacen.leer_manifiesto())
+    manifiesto = almacen.sincronizar()
+    cambio = almacen.version_manifiesto(manifiesto) != antes
+    if cambio:
+        # Pasa este proceso a la instantánea recién publicada
+        almacen.recargar()
+    return cambio
+
+
+def vigilar(intervalo=INTERVALO, detener=None):
+    """Ingesta cada ``intervalo`` segundos hasta que se active el evento ``detener``"""
+    detener = detener or threading.Event()
+    logger.info(f"Vigilando boletines nuevos cada {intervalo} s")
+    while not detener.is_set():
+        try:
+            if ingestar():
+                logger.info("Boletines nuevos o modificados ingestados")
+        except Exception as e:
+            logger.error(f"Error en la ingesta: {e}")
+        detener.wait(intervalo)
+
+
+def iniciar_vigilante(intervalo=INTERVALO):
+    """Arranca el vigilante en un hilo de fondo (daemon) y devuelve el evento para detenerlo"""
+    detener = threading.Event()
+    hilo = threading.Thread(target=vigilar, args=(intervalo, detener), name="vigilante-sipsa", daemon=True)
+    hilo.start()
+    return detener
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingesta incremental de boletines SIPSA")
+    parser.add_argument("--vigilar", action="store_true", help="seguir revisando el histórico")
+    parser.add_argument("--intervalo", type=int, default=INTERVALO, help="segundos entre revisiones")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.vigilar:
+        vigilar(args.intervalo)
+    else:
+        inicio = time.time()
+        cambio = ingestar()
+        print(f"{'Almacén actualizado' if cambio else 'Almacén al día'} en {time.time() - inicio:.1f} s")
+
+    # Libros cuyo nombre no trae la semana: se informan en vez de asignarles una fecha
+    _, no_reconocidos = catalogo_boletines()
+    for path in no_reconocidos:
+        print(f"⚠️ Sin fecha reconocible en el nombre: {almacen.ruta_relativa(path)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Métricas de tiempos y contadores en formato Prometheus.
+
+Registro en memoria del proceso: contadores (aciertos/fallos de caché,
+solicitudes), medidores (registros cargados) e histogramas de duración por
+etapa (lectura de Excel, búsqueda de encabezado, normalización, consulta,
+suavizado, gráfico...). La app los publica en ``/metrics``.
+
+Lo que se mide dentro de un proceso del pool (``paralelo``) se captura allí y
+se suma al registro del proceso principal al recibir el resultado. Con varios
+workers de gunicorn cada worker tiene su propio registro.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# =========================
+# ⚙️ Configuración
+# =========================
+# Límites (segundos) de los histogramas de duración
+LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+DESCRIPCIONES = {
+    "sipsa_etapa_segundos": ("histogram", "Duración de cada etapa del procesamiento"),
+    "sipsa_solicitud_segundos": ("histogram", "Duración de las solicitudes HTTP por ruta"),
+    "sipsa_solicitudes_total": ("counter", "Solicitudes HTTP por ruta y código de estado"),
+    "sipsa_cache_total": ("counter", "Consultas a la caché de resultados por resultado"),
+    "sipsa_tendencias_total": ("counter", "Tendencias por mercado calculadas o tomadas de memoria"),
+    "sipsa_boletines_procesados_total": ("counter", "Boletines procesados por el pool, con o sin error"),
+    "sipsa_trabajos_total": ("counter", "Trabajos de análisis por evento (nuevo, unido, listo, error)"),
+    "sipsa_imagenes_total": ("counter", "Imágenes de gráficos exportadas, dibujadas o tomadas de la caché"),
+    "sipsa_puntos_grafico_total": ("counter", "Puntos de las trazas de los gráficos, originales y dibujados"),
+    "sipsa_validaciones_total": ("counter", "Consultas revisadas contra el vocabulario, aceptadas o rechazadas"),
+    "sipsa_almacen_registros": ("gauge", "Registros de la tabla cargada en memoria"),
+    "sipsa_almacen_bytes": ("gauge", "Memoria ocupada por la tabla cargada"),
+    "sipsa_arranque_segundos": ("gauge", "Tiempo de arranque de la app, importaciones incluidas"),
+    "sipsa_importacion_segundos": ("gauge", "Tiempo de importación de los módulos cargados bajo demanda"),
+}
+
+_bloqueo = threading.Lock()
+_contadores = {}
+_medidores = {}
+# (nombre, etiquetas) -> [conteos por límite, suma, cuenta]
+_histogramas = {}
+_local = threading.local()
+
+
+# =========================
+# 🧩 Registro
+# =========================
+def _etiquetas(etiquetas):
+    return tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def _capturando():
+    return getattr(_local, "captura", None)
+
+
+def contar(nombre, valor=1, **etiquetas):
+    captura = _capturando()
+    if captura is not None:
+        captura.append(("contador", nombre, valor, etiquetas))
+        return
+    clave = (nombre, _etiquetas(etiquetas))
+    with _bloqueo:
+        _contadores[clave] = _contadores.get(clave, 0) + valor
+
+
+def fijar(nombre, valor, **etiquetas):
+    with _bloqueo:
+        _medidores[(nombre, _etiquetas(etiquetas))] = valor
+
+
+def observar(nombre, segundos, **etiquetas):
+    captura = _capturando()
+    if captura is not None:
+        captura.append(("histograma", nombre, segundos, etiquetas))
+        return
+    clave = (nombre, _etiquetas(etiquetas))
+    with _bloqueo:
+        conteos, suma, cuenta = _histogramas.get(clave) or ([0] * len(LIMITES), 0.0, 0)
+        for i, limite in enumerate(LIMITES):
+            if segundos <= limite:
+                conteos[i] += 1
+        _histogramas[clave] = [conteos, suma + segundos, cuenta + 1]
+
+
+@contextmanager
+def medir(etapa, **etiquetas):
+    """Registra la duración del bloque en sipsa_etapa_segundos{etapa=...}"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar("sipsa_etapa_segundos", time.perf_counter() - inicio, etapa=etapa, **etiquetas)
+
+
+@contextmanager
+def capturar():
+    """Guarda en una lista (en vez del registro) lo medido dentro del bloque; ver ``fusionar``"""
+    anterior = _capturando()
+    _local.captura = []
+    try:
+        yield _local.captura
+    finally:
+        _local.captura = anterior
+
+
+def fusionar(observaciones):
+    """Suma al registro las observaciones capturadas (por ejemplo, en otro proceso)"""
+    for tipo, nombre, valor, etiquetas in observaciones:
+        (contar if tipo == "contador" else observar)(nombre, valor, **etiquetas)
+
+
+# =========================
+# 📤 Exportación
+# =========================
+def _formato(etiquetas, extra=()):
+    pares = [*etiquetas, *extra]
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+
+def exportar():
+    """Texto en formato de exposición de Prometheus"""
+    with _bloqueo:
+        contadores = dict(_contadores)
+        medidores = dict(_medidores)
+        histogramas = {k: (list(v[0]), v[1], v[2]) for k, v in _histogramas.items()}
+
+    lineas = []
+    nombres = sorted({n for n, _ in contadores} | {n for n, _ in medidores} | {n for n, _ in histogramas})
+    for nombre in nombres:
+        tipo, ayuda = DESCRIPCIONES.get(nombre, ("untyped", nombre))
+        lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+        for (n, etiquetas), valor in sorted(contadores.items()):
+            if n == nombre:
+                lineas.append(f"{nombre}{_formato(etiquetas)} {valor}")
+        for (n, etiquetas), valor in sorted(medidores.items()):
+            if n == nombre:
+                lineas.append(f"{nombre}{_formato(etiquetas)} {valor}")
+        for (n, etiquetas), (conteos, suma, cuenta) in sorted(histogramas.items()):
+            if n == nombre:
+                for limite, conteo in zip(LIMITES, conteos):
+                    lineas.append(f"{nombre}_bucket{_formato(etiquetas, [('le', limite)])} {conteo}")
+                lineas.append(f"{nombre}_bucket{_formato(etiquetas, [('le', '+Inf')])} {cuenta}")
+                lineas.append(f"{nombre}_sum{_formato(etiquetas)} {suma:.6f}")
+                lineas.append(f"{nombre}_count{_formato(etiquetas)} {cuenta}")
+    return "\n".join(lineas) + "\n"
+
+
+def reiniciar():
+    """Vacía el registro"""
+    with _bloqueo:
+        _contadores.clear()
+        _medidores.clear()
+        _histogramas.clear()
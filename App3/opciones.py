@@ -0,0 +1,28 @@
+"""Opciones de la interfaz que no dependen del motor de análisis.
+
+Categorías (hojas) de los boletines y motores de suavizado. Vive aparte para
+que la app pueda pintar el formulario sin importar pandas ni Plotly.
+"""
+import os
+
+# =========================
+# ⚙️ Configuración
+# =========================
+opciones_hoja = {
+    "1.1": "Verduras y hortalizas",
+    "1.2": "Frutas frescas",
+    "1.3": "Tubérculos, raíces y plátanos",
+    "1.4": "Granos y cereales",
+    "1.5": "Huevos y lácteos",
+    "1.6": "Carnes",
+    "1.7": "Pescados",
+    "1.8": "Productos procesados",
+    "1.9": "Abastecimiento semanal por grupo de alimentos"
+}
+
+MOTORES = {
+    "lowess": "LOWESS (ajuste local)",
+    "ewma": "Media exponencial",
+    "movil": "Media móvil centrada"
+}
+MOTOR = os.environ.get("SIPSA_SUAVIZADO", "lowess")
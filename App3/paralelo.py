@@ -0,0 +1,86 @@
+"""Procesamiento de boletines en paralelo con un pool de procesos.
+
+Cada libro es independiente y su lectura es trabajo de CPU (XML), así que se
+reparte entre procesos. Los resultados vuelven en el mismo orden de la lista de
+archivos y el fallo de un archivo no detiene a los demás. El avance se ve en
+consola (tqdm) y, dentro de un trabajo de la app, en su estado (``trabajos``).
+
+Los procesos salen de un servidor ``forkserver`` (``spawn`` donde no lo hay,
+como en Windows), no de un fork del proceso que llama: la app llama desde
+hilos (trabajos, vigilante) y un fork copiaría candados tomados por otros
+hilos (logging, SQLite) que en el hijo nunca se liberarían.
+"""
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
+import logging
+
+import metricas
+import trabajos
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+# Procesos de trabajo; SIPSA_TRABAJADORES=1 procesa en serie en el mismo proceso
+TRABAJADORES = int(os.environ.get("SIPSA_TRABAJADORES", 0)) or os.cpu_count() or 1
+# Archivos por tarea enviada al pool; 0 lo calcula según archivos y trabajadores
+TAMANO_LOTE = int(os.environ.get("SIPSA_TAMANO_LOTE", 0))
+# Cómo se crean los procesos del pool (ver arriba)
+INICIO_PROCESOS = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+class _Aislado:
+    """Envuelve la función para devolver (path, resultado, error, métricas) sin propagar excepciones"""
+
+    def __init__(self, funcion):
+        self.funcion = funcion
+
+    def __call__(self, path):
+        # Lo medido aquí viaja con el resultado: el proceso del pool no expone /metrics
+        with metricas.capturar() as medidas:
+            inicio = time.perf_counter()
+            try:
+                resultado, error = self.funcion(path), None
+            except Exception as e:
+                resultado, error = None, f"{type(e).__name__}: {e}"
+            metricas.observar("sipsa_etapa_segundos", time.perf_counter() - inicio, etapa="boletin")
+            metricas.contar("sipsa_boletines_procesados_total", estado="error" if error else "ok")
+        return path, resultado, error, medidas
+
+
+def _recoger(resultados, total, desc):
+    """Junta los resultados a medida que llegan e informa el avance archivo por archivo"""
+    recogidos = []
+    for resultado in tqdm(resultados, total=total, desc=desc, unit="archivo", disable=not total):
+        recogidos.append(resultado)
+        trabajos.avanzar(desc, len(recogidos), total)
+    return recogidos
+
+
+def procesar_archivos(funcion, archivos, trabajadores=None, tamano_lote=None, desc="Procesando archivos"):
+    """Aplica ``funcion(path)`` a cada archivo y devuelve [(path, resultado, error)] en orden.
+
+    ``funcion`` debe poder enviarse a otro proceso (definida a nivel de módulo,
+    o un ``functools.partial`` de una).
+    """
+    archivos = list(archivos)
+    trabajadores = min(trabajadores or TRABAJADORES, len(archivos))
+    tarea = _Aislado(funcion)
+
+    if trabajadores <= 1:
+        resultados = _recoger(map(tarea, archivos), len(archivos), desc)
+    else:
+        lote = tamano_lote or TAMANO_LOTE or max(1, len(archivos) // (trabajadores * 4))
+        contexto = multiprocessing.get_context(INICIO_PROCESOS)
+        with ProcessPoolExecutor(max_workers=trabajadores, mp_context=contexto) as pool:
+            resultados = _recoger(pool.map(tarea, archivos, chunksize=lote), len(archivos), desc)
+
+    for path, _, error, medidas in resultados:
+        metricas.fusionar(medidas)
+        if error:
+            logger.warning(f"No se pudo procesar {os.path.basename(path)}: {error}")
+    return [(path, resultado, error) for path, resultado, error, _ in resultados]
@@ -0,0 +1,106 @@
+"""Reducción de puntos de las series que se dibujan, según el ancho del gráfico.
+
+Una serie larga (varios años de boletines por mercado) manda a Plotly más
+puntos de los que caben en los píxeles del gráfico. Antes de serializar cada
+traza se reduce a unos PUNTOS_POR_PIXEL × ancho puntos:
+
+- ``lttb``: Largest-Triangle-Three-Buckets; conserva la forma visual (picos y
+  valles) eligiendo en cada tramo el punto que forma el triángulo más grande.
+- ``minmax``: el mínimo y el máximo de cada tramo.
+
+Solo se reduce lo que se dibuja: las estadísticas, el promedio y las
+tendencias se calculan antes, con todos los registros.
+"""
+import os
+import numpy as np
+
+import metricas
+
+# =========================
+# ⚙️ Configuración
+# =========================
+METODOS = ("lttb", "minmax", "no")
+METODO = os.environ.get("SIPSA_SUBMUESTREO", "lttb")
+# Ancho (px) por defecto, mínimo y máximo del gráfico; se redondea a múltiplos de PASO_ANCHO
+ANCHO_GRAFICO = 1200
+MIN_ANCHO, MAX_ANCHO = 300, 4000
+PASO_ANCHO = 100
+PUNTOS_POR_PIXEL = 1
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def ancho_grafico(ancho):
+    """Ancho del gráfico acotado y redondeado hacia arriba (menos variantes en la caché); 0 o None = por defecto"""
+    if not ancho:
+        return ANCHO_GRAFICO
+    ancho = min(max(int(ancho), MIN_ANCHO), MAX_ANCHO)
+    return -(-ancho // PASO_ANCHO) * PASO_ANCHO
+
+
+def puntos_maximos(ancho):
+    return int(ancho_grafico(ancho) * PUNTOS_POR_PIXEL)
+
+
+def _numerico(x):
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype("datetime64[ns]").astype("int64").astype("float64")
+    return x.astype("float64")
+
+
+def lttb(x, y, puntos):
+    """Posiciones de los ``puntos`` que elige Largest-Triangle-Three-Buckets (el primero y el último siempre)"""
+    n = len(y)
+    if puntos >= n or puntos < 3:
+        return np.arange(n)
+    x, y = _numerico(x), np.asarray(y, dtype="float64")
+
+    # puntos - 2 tramos entre el primero y el último
+    bordes = np.linspace(1, n - 1, puntos - 1).astype(np.intp)
+    posiciones = np.empty(puntos, dtype=np.intp)
+    posiciones[0], posiciones[-1] = 0, n - 1
+    anterior = 0
+    for i in range(puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        # Vértice del tramo siguiente: su promedio (en el último tramo, el punto final)
+        siguiente = slice(fin, bordes[i + 2] if i + 2 < len(bordes) else n)
+        cx, cy = x[siguiente].mean(), y[siguiente].mean()
+        area = np.abs((x[anterior] - cx) * (y[inicio:fin] - y[anterior])
+                      - (x[anterior] - x[inicio:fin]) * (cy - y[anterior]))
+        anterior = inicio + int(np.argmax(np.nan_to_num(area, nan=-1.0)))
+        posiciones[i + 1] = anterior
+    return posiciones
+
+
+def minmax(y, puntos):
+    """Posiciones (en orden) del mínimo y el máximo de cada tramo, más el primero y el último punto"""
+    n = len(y)
+    if puntos >= n or puntos < 4:
+        return np.arange(n)
+    y = np.asarray(y, dtype="float64")
+    bordes = np.linspace(0, n, (puntos - 2) // 2 + 1).astype(np.intp)
+    posiciones = {0, n - 1}
+    for inicio, fin in zip(bordes[:-1], bordes[1:]):
+        if fin > inicio and not np.isnan(y[inicio:fin]).all():
+            posiciones.update((inicio + int(np.nanargmin(y[inicio:fin])), inicio + int(np.nanargmax(y[inicio:fin]))))
+    return np.array(sorted(posiciones), dtype=np.intp)
+
+
+# =========================
+# 📉 Reducción
+# =========================
+def reducir(x, y, ancho=None, metodo=None):
+    """(x, y) de una traza con a lo sumo ``puntos_maximos(ancho)`` puntos; ``x`` ordenado"""
+    metodo = metodo or METODO
+    if metodo not in METODOS:
+        raise ValueError(f"Método de reducción desconocido: {metodo}")
+    x, y = np.asarray(x), np.asarray(y)
+    puntos = puntos_maximos(ancho)
+    metricas.contar("sipsa_puntos_grafico_total", len(y), serie="original")
+    if metodo != "no" and len(y) > puntos:
+        posiciones = lttb(x, y, puntos) if metodo == "lttb" else minmax(y, puntos)
+        x, y = x[posiciones], y[posiciones]
+    metricas.contar("sipsa_puntos_grafico_total", len(y), serie="dibujada")
+    return x, y
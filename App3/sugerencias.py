@@ -0,0 +1,176 @@
+"""Sugerencias (autocompletado) de productos y mercados, por hoja.
+
+Índice en memoria del vocabulario normalizado (``normalizar``: minúsculas y
+sin tildes) de la tabla cargada: por hoja, cada nombre de producto y de
+mercado con su nombre original más frecuente y su número de registros. Se
+arma una vez por instantánea del almacén (unas décimas de segundo) y luego
+responde en microsegundos:
+
+- por prefijo: cada palabra escrita es el comienzo de alguna palabra del
+  nombre ("tom ch" -> "tomate chonto"); búsqueda binaria sobre la lista
+  ordenada de palabras, el equivalente de un trie sin nodos en Python;
+- por contenido: el texto aparece dentro del nombre, como lo busca el almacén;
+- aproximadas, por trigramas de caracteres: "tomate chont0" -> "tomate chonto".
+
+``existe`` dice si una búsqueda encontraría algún nombre, para rechazar una
+consulta con un error de tipeo antes de encolar el recorrido del almacén.
+"""
+import bisect, threading
+from collections import Counter, defaultdict, namedtuple
+import logging
+
+import almacen
+import metricas
+from boletines import normalizar
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+CAMPOS = ("producto", "mercado")
+LIMITE = 10
+MAX_LIMITE = 50
+# Fracción mínima de los trigramas del texto que debe tener un nombre para sugerirlo como aproximado
+MIN_SIMILITUD = 0.5
+
+# nombres ordenados, con su etiqueta (nombre original), registros y número de trigramas;
+# palabras: (palabra, posición) ordenadas; trigramas: trigrama -> posiciones
+Vocabulario = namedtuple("Vocabulario", "nombres etiquetas registros tamanos palabras trigramas")
+
+_indice = None
+_bloqueo = threading.Lock()
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def trigramas(texto):
+    """Trigramas de caracteres del texto, con bordes de palabra (" to", "tom", ...)"""
+    texto = f" {' '.join(texto.split())} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+def _vocabulario(conteos):
+    """Vocabulario de una hoja a partir de {nombre normalizado: Counter(nombre original -> registros)}"""
+    nombres = sorted(conteos)
+    etiquetas = [conteos[n].most_common(1)[0][0] for n in nombres]
+    registros = [sum(conteos[n].values()) for n in nombres]
+    palabras = sorted((palabra, i) for i, nombre in enumerate(nombres) for palabra in set(nombre.split()))
+    por_trigrama = defaultdict(list)
+    tamanos = []
+    for i, nombre in enumerate(nombres):
+        propios = trigramas(nombre)
+        tamanos.append(len(propios))
+        for trigrama in propios:
+            por_trigrama[trigrama].append(i)
+    return Vocabulario(nombres, etiquetas, registros, tamanos, palabras, dict(por_trigrama))
+
+
+def _construir(datos):
+    """{campo: {hoja (None = todas): Vocabulario}} de una instantánea"""
+    indice = {}
+    for campo in CAMPOS:
+        pares = datos.tabla.groupby(["hoja", f"{campo}_norm", campo], observed=True).size()
+        por_hoja = defaultdict(lambda: defaultdict(Counter))
+        for (hoja, nombre, original), registros in pares.items():
+            for clave in (hoja, None):
+                por_hoja[clave][nombre][original] += int(registros)
+        indice[campo] = {hoja: _vocabulario(conteos) for hoja, conteos in por_hoja.items()}
+    return indice
+
+
+def indice(datos=None):
+    """Índice de la instantánea (por defecto la vigente); se arma la primera vez que se pide cada versión"""
+    global _indice
+    datos = datos or almacen.instantanea_vigente()
+    actual = _indice
+    if actual is not None and actual[0] == datos.version:
+        return actual[1]
+    with _bloqueo:
+        if _indice is None or _indice[0] != datos.version:
+            with metricas.medir("indice_sugerencias"):
+                _indice = (datos.version, _construir(datos))
+            # Con el almacén vacío no hay vocabulario de ninguna hoja
+            todas = {campo: por_hoja.get(None) for campo, por_hoja in _indice[1].items()}
+            logger.info(f"Índice de sugerencias armado: "
+                        f"{', '.join(f'{len(v.nombres) if v else 0} {c}s' for c, v in todas.items())}")
+        return _indice[1]
+
+
+def _vocabulario_de(campo, hoja, datos):
+    if campo not in CAMPOS:
+        raise ValueError(f"Campo no válido: {campo}")
+    return indice(datos)[campo].get(hoja or None)
+
+
+def _por_prefijo(vocabulario, buscado):
+    """Posiciones de los nombres en que cada palabra buscada empieza alguna palabra del nombre"""
+    palabras = sorted(set(buscado.split()), key=len, reverse=True)
+    # Candidatos de la palabra más larga (la más selectiva); las demás se revisan en cada candidato
+    primera = palabras[0]
+    candidatos = set()
+    i = bisect.bisect_left(vocabulario.palabras, (primera,))
+    while i < len(vocabulario.palabras) and vocabulario.palabras[i][0].startswith(primera):
+        candidatos.add(vocabulario.palabras[i][1])
+        i += 1
+    return [i for i in candidatos
+            if all(any(p.startswith(buscada) for p in vocabulario.nombres[i].split()) for buscada in palabras[1:])]
+
+
+def _aproximadas(vocabulario, buscado):
+    """(similitud, dice, posición) de los nombres que tienen al menos MIN_SIMILITUD de los trigramas buscados.
+
+    La similitud es la fracción de los trigramas del texto presentes en el
+    nombre (un nombre largo no se castiga); Dice desempata a favor del más
+    parecido en largo.
+    """
+    propios = trigramas(buscado)
+    comunes = Counter()
+    for trigrama in propios:
+        comunes.update(vocabulario.trigramas.get(trigrama, ()))
+    return [(n / len(propios), 2 * n / (len(propios) + vocabulario.tamanos[i]), i) for i, n in comunes.items()
+            if n >= MIN_SIMILITUD * len(propios)]
+
+
+# =========================
+# 🔎 Sugerencias
+# =========================
+def sugerir(campo, texto, hoja=None, limite=LIMITE, datos=None):
+    """Nombres de ``campo`` ("producto" o "mercado") de la hoja que completan o se parecen al texto.
+
+    Primero los que coinciden por prefijo (los que empiezan por el texto
+    antes), luego los que lo contienen y al final los aproximados; dentro de
+    cada tipo, los de más registros. Cada sugerencia es un dict con nombre
+    (original), normalizado, registros y tipo (prefijo|contiene|aproximada).
+    """
+    vocabulario = _vocabulario_de(campo, hoja, datos)
+    buscado = normalizar(texto)
+    limite = min(max(1, limite), MAX_LIMITE)
+    if vocabulario is None or not buscado:
+        return []
+
+    elegidos = {}
+    prefijo = sorted(_por_prefijo(vocabulario, buscado),
+                     key=lambda i: (not vocabulario.nombres[i].startswith(buscado), -vocabulario.registros[i]))
+    for i in prefijo[:limite]:
+        elegidos[i] = "prefijo"
+    if len(elegidos) < limite:
+        contiene = [i for i, nombre in enumerate(vocabulario.nombres) if buscado in nombre and i not in elegidos]
+        for i in sorted(contiene, key=lambda i: -vocabulario.registros[i])[:limite - len(elegidos)]:
+            elegidos[i] = "contiene"
+    if len(elegidos) < limite:
+        similares = sorted((-s, -dice, -vocabulario.registros[i], i)
+                           for s, dice, i in _aproximadas(vocabulario, buscado) if i not in elegidos)
+        for *_, i in similares[:limite - len(elegidos)]:
+            elegidos[i] = "aproximada"
+
+    return [{"nombre": vocabulario.etiquetas[i], "normalizado": vocabulario.nombres[i],
+             "registros": vocabulario.registros[i], "tipo": tipo} for i, tipo in elegidos.items()]
+
+
+def existe(campo, texto, hoja=None, datos=None):
+    """True si algún nombre de ``campo`` en la hoja contiene el texto (la búsqueda del almacén encontraría algo)"""
+    vocabulario = _vocabulario_de(campo, hoja, datos)
+    buscado = normalizar(texto)
+    return vocabulario is not None and any(buscado in nombre for nombre in vocabulario.nombres)
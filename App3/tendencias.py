@@ -0,0 +1,185 @@
+"""Tendencias suavizadas de las series de precios por mercado.
+
+Dos motores:
+- ``lowess``: el de siempre (statsmodels), un ajuste por mercado.
+- ``ewma`` / ``movil``: media exponencial (ida y vuelta, sin desfase) o media
+  móvil centrada, calculadas para todos los mercados a la vez en NumPy; el
+  costo casi no crece con el número de mercados. Cada mercado se suaviza
+  sobre sus propias fechas y con su propia ventana: la tendencia no depende
+  de los demás mercados del lote.
+
+Las tendencias se memorizan por (producto, mercado, rango de fechas, frac,
+motor) junto con una huella de los datos, así una serie repetida no se vuelve
+a suavizar.
+"""
+import pandas as pd
+import numpy as np
+import hashlib, threading
+from collections import OrderedDict
+from statsmodels.nonparametric.smoothers_lowess import lowess
+import logging
+
+import metricas
+from opciones import MOTORES, MOTOR
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+# Fracción de los puntos usada en cada ajuste (lowess) o como ventana (ewma / movil)
+FRAC = 0.3
+# Tendencias guardadas en memoria del proceso
+MAX_MEMORIA = 1024
+
+# Compartida por los hilos de trabajos y de solicitudes: se lee y se escribe con el bloqueo tomado
+_memoria = OrderedDict()
+_bloqueo = threading.Lock()
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def _huella(fechas, precios):
+    h = hashlib.sha1(np.ascontiguousarray(fechas, dtype="int64").tobytes())
+    h.update(np.ascontiguousarray(precios, dtype="float64").tobytes())
+    return h.hexdigest()
+
+
+def _recordar(clave, valor):
+    with _bloqueo:
+        _memoria[clave] = valor
+        _memoria.move_to_end(clave)
+        while len(_memoria) > MAX_MEMORIA:
+            _memoria.popitem(last=False)
+
+
+def _recuperar(clave):
+    """Tendencia memorizada (y marcada como usada), o None"""
+    with _bloqueo:
+        valor = _memoria.get(clave)
+        if valor is not None:
+            _memoria.move_to_end(clave)
+        return valor
+
+
+def _ventana(n, frac):
+    return max(3, int(round(frac * n)))
+
+
+def _apilar(series):
+    """Matriz con una serie por columna, desde la primera fila y con NaN de relleno al final"""
+    matriz = np.full((max(map(len, series), default=0), len(series)), np.nan)
+    for j, serie in enumerate(series):
+        matriz[:len(serie), j] = serie
+    return matriz
+
+
+def _ewma_lote(matriz, alfa):
+    """Media exponencial por columnas, saltando los NaN (un mercado sin dato esa semana)"""
+    salida = np.full(matriz.shape, np.nan)
+    estado = np.full(matriz.shape[1], np.nan)
+    for i, fila in enumerate(matriz):
+        valido = ~np.isnan(fila)
+        nuevo = np.isnan(estado) & valido
+        estado = np.where(nuevo, fila, estado)
+        seguir = valido & ~nuevo
+        estado = np.where(seguir, alfa * fila + (1 - alfa) * estado, estado)
+        salida[i] = estado
+    return salida
+
+
+def suavizar_lote(matriz, motor="ewma", frac=FRAC):
+    """Suaviza cada columna de una matriz de series (ver ``_apilar``), cada una con su propia ventana.
+
+    La ventana de una columna sale de sus datos (``frac`` de ellos), así que
+    su tendencia es la misma que si se suavizara sola.
+    """
+    matriz = np.asarray(matriz, dtype="float64")
+    ventanas = np.array([_ventana(n, frac) for n in (~np.isnan(matriz)).sum(axis=0)], dtype=np.intp)
+
+    if motor == "ewma":
+        # Ida y vuelta: la media exponencial de un solo sentido va retrasada
+        alfa = 2 / (ventanas + 1)
+        ida = _ewma_lote(matriz, alfa)
+        vuelta = _ewma_lote(matriz[::-1], alfa)[::-1]
+        suave = (ida + vuelta) / 2
+    elif motor == "movil":
+        # Media centrada con sumas acumuladas, contando solo los datos presentes
+        valido = ~np.isnan(matriz)
+        ceros = np.zeros((1, matriz.shape[1]))
+        suma = np.vstack([ceros, np.cumsum(np.where(valido, matriz, 0), axis=0)])
+        cuenta = np.vstack([ceros, np.cumsum(valido, axis=0)])
+        idx = np.arange(len(matriz))[:, None]
+        inicio = np.clip(idx - ventanas // 2, 0, len(matriz))
+        fin = np.clip(idx + ventanas // 2 + 1, 0, len(matriz))
+
+        def tramo(acumulado):
+            return np.take_along_axis(acumulado, fin, axis=0) - np.take_along_axis(acumulado, inicio, axis=0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            suave = tramo(suma) / tramo(cuenta)
+    else:
+        raise ValueError(f"Motor de suavizado desconocido: {motor}")
+
+    # Solo hay tendencia donde el mercado tiene dato
+    return np.where(np.isnan(matriz), np.nan, suave)
+
+
+# =========================
+# 📈 Tendencias por mercado
+# =========================
+def tendencias_por_mercado(df, producto, motor=None, frac=FRAC):
+    """{mercado: (fechas, tendencia)} de la serie de precio medio de cada mercado.
+
+    ``df`` tiene las columnas fecha, mercado y precio_medio. Los mercados con
+    menos de dos puntos no tienen tendencia.
+    """
+    motor = motor or MOTOR
+    if motor not in MOTORES:
+        raise ValueError(f"Motor de suavizado desconocido: {motor}")
+
+    resultado, faltantes = {}, {}
+    for mercado, grupo in df.groupby("mercado", sort=False):
+        grupo = grupo.sort_values("fecha")
+        if len(grupo) < 2:
+            continue
+        fechas = grupo["fecha"].to_numpy(dtype="datetime64[ns]")
+        precios = grupo["precio_medio"].to_numpy(dtype="float64")
+        clave = (producto, mercado, str(fechas[0]), str(fechas[-1]), frac, motor, _huella(fechas, precios))
+        memorizada = _recuperar(clave)
+        if memorizada is not None:
+            resultado[mercado] = (fechas, memorizada)
+        else:
+            faltantes[mercado] = (clave, grupo)
+
+    metricas.contar("sipsa_tendencias_total", len(resultado), resultado="memoria")
+    if not faltantes:
+        return resultado
+
+    with metricas.medir("suavizado", motor=motor):
+        _suavizar(faltantes, resultado, motor, frac)
+    metricas.contar("sipsa_tendencias_total", len(faltantes), resultado="calculada")
+    logger.debug(f"Tendencias ({motor}): {len(faltantes)} calculadas, {len(resultado) - len(faltantes)} en memoria")
+    return resultado
+
+
+def _suavizar(faltantes, resultado, motor, frac):
+    """Calcula, guarda en memoria y agrega a ``resultado`` las tendencias de los mercados faltantes"""
+    if motor == "lowess":
+        for mercado, (clave, grupo) in faltantes.items():
+            try:
+                y_suav = lowess(grupo["precio_medio"], pd.to_numeric(grupo["fecha"]), frac=frac, return_sorted=False)
+            except Exception as e:
+                logger.warning(f"Error calculando tendencia para {mercado}: {e}")
+                continue
+            _recordar(clave, y_suav)
+            resultado[mercado] = (grupo["fecha"].to_numpy(dtype="datetime64[ns]"), y_suav)
+    else:
+        # Cada mercado con sus propias fechas con dato; la matriz solo los junta para calcularlos a la vez
+        series = [grupo.groupby("fecha")["precio_medio"].mean().dropna() for _, grupo in faltantes.values()]
+        suave = suavizar_lote(_apilar([s.to_numpy() for s in series]), motor, frac)
+        for j, (mercado, (clave, grupo)) in enumerate(faltantes.items()):
+            y_suav = pd.Series(suave[:len(series[j]), j], index=series[j].index).reindex(grupo["fecha"]).to_numpy()
+            _recordar(clave, y_suav)
+            resultado[mercado] = (grupo["fecha"].to_numpy(dtype="datetime64[ns]"), y_suav)
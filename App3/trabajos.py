@@ -0,0 +1,182 @@
+"""Trabajos de análisis en segundo plano, con avance consultable.
+
+Una consulta enviada se convierte en un trabajo: la solicitud responde de
+inmediato con su id y un pool de hilos del proceso la ejecuta, así ningún
+worker de gunicorn queda ocupado durante el recorrido de los boletines. El
+estado (etapa, archivos hechos / total) se guarda en SQLite, de modo que
+cualquier worker puede responder al sondeo o al flujo SSE de un trabajo.
+Dos consultas iguales en curso se unen en un solo trabajo.
+
+Quien ejecuta un trabajo informa su avance con ``avanzar``; fuera de un
+trabajo la llamada no hace nada.
+"""
+import os, time, json, uuid, sqlite3, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import cache
+import metricas
+
+logger = logging.getLogger(__name__)
+
+# =========================
+# ⚙️ Configuración
+# =========================
+RUTA_TRABAJOS = os.environ.get(
+    "SIPSA_TRABAJOS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos", "cache", "trabajos.sqlite"))
+# Hilos que ejecutan trabajos en cada worker; los demás trabajos esperan en cola
+HILOS = int(os.environ.get("SIPSA_TRABAJOS", 2))
+# Segundos sin noticias tras los que un trabajo activo se da por interrumpido
+VENCIDO = 300
+# Segundos que se conserva el registro de un trabajo
+VIDA = 24 * 3600
+# Segundos mínimos entre dos escrituras del avance de una misma etapa
+INTERVALO_AVANCE = 0.25
+# Resultados que se guardan en memoria del proceso (además de la caché en disco)
+MAX_RESULTADOS = 16
+
+ACTIVOS = ("en_cola", "en_curso")
+CAMPOS = ("id", "peticion", "estado", "etapa", "hechos", "total", "error", "creado", "actualizado")
+
+ESQUEMA = ("""CREATE TABLE IF NOT EXISTS trabajos (
+                  id TEXT PRIMARY KEY,
+                  consulta TEXT NOT NULL,
+                  peticion TEXT NOT NULL,
+                  estado TEXT NOT NULL,
+                  etapa TEXT,
+                  hechos INTEGER NOT NULL DEFAULT 0,
+                  total INTEGER NOT NULL DEFAULT 0,
+                  error TEXT,
+                  creado REAL NOT NULL,
+                  actualizado REAL NOT NULL)""",
+           "CREATE INDEX IF NOT EXISTS trabajos_consulta ON trabajos (consulta, estado)")
+
+_pool = None
+_bloqueo = threading.Lock()
+_resultados = OrderedDict()
+_local = threading.local()
+
+
+# =========================
+# 🧩 Funciones auxiliares
+# =========================
+def _conexion():
+    return cache.conectar(RUTA_TRABAJOS, *ESQUEMA)
+
+
+def _ejecutor():
+    """Pool de hilos del proceso; se crea en el primer trabajo (después del fork de gunicorn)"""
+    global _pool
+    with _bloqueo:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=HILOS, thread_name_prefix="trabajo-sipsa")
+        return _pool
+
+
+def _actualizar(id_trabajo, **campos):
+    asignaciones = ", ".join(f"{campo} = ?" for campo in campos)
+    try:
+        with _conexion() as con:
+            con.execute(f"UPDATE trabajos SET {asignaciones}, actualizado = ? WHERE id = ?",
+                        (*campos.values(), time.time(), id_trabajo))
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo actualizar el trabajo {id_trabajo[:8]}: {e}")
+
+
+def _correr(id_trabajo, peticion, ejecutar):
+    _local.trabajo, _local.etapa, _local.escrito = id_trabajo, None, 0.0
+    _actualizar(id_trabajo, estado="en_curso", etapa="Iniciando")
+    inicio = time.perf_counter()
+    try:
+        resultado = ejecutar(peticion)
+    except Exception as e:
+        logger.error(f"Error en el trabajo {id_trabajo[:8]}: {e}")
+        resultado = {"error": f"Error en el procesamiento: {str(e)}"}
+    finally:
+        _local.trabajo = None
+    metricas.observar("sipsa_etapa_segundos", time.perf_counter() - inicio, etapa="trabajo")
+
+    # El resultado queda a mano antes de anunciar el final
+    with _bloqueo:
+        _resultados[id_trabajo] = resultado
+        while len(_resultados) > MAX_RESULTADOS:
+            _resultados.popitem(last=False)
+    error = resultado.get("error")
+    _actualizar(id_trabajo, estado="error" if error else "listo", etapa=None, error=error)
+    metricas.contar("sipsa_trabajos_total", evento="error" if error else "listo")
+    logger.info(f"Trabajo {id_trabajo[:8]} {'con error' if error else 'listo'} "
+                f"en {time.perf_counter() - inicio:.1f} s")
+
+
+# =========================
+# 📨 Envío y seguimiento
+# =========================
+def enviar(consulta, peticion, ejecutar):
+    """Trabajo de una consulta: el que ya está en curso para ella o uno nuevo.
+
+    ``consulta`` es la clave de la consulta (consultas que dan el mismo
+    resultado comparten clave), ``peticion`` un dict serializable en JSON con
+    lo necesario para ejecutarla y ``ejecutar(peticion)`` devuelve el
+    resultado. Devuelve (id, nuevo).
+    """
+    ahora = time.time()
+    with _conexion() as con:
+        # La búsqueda y el alta en una sola transacción: dos workers no duplican el trabajo
+        con.execute("BEGIN IMMEDIATE")
+        fila = con.execute(f"""SELECT id FROM trabajos
+                               WHERE consulta = ? AND estado IN {ACTIVOS} AND actualizado > ?
+                               ORDER BY creado DESC LIMIT 1""", (consulta, ahora - VENCIDO)).fetchone()
+        if fila is not None:
+            metricas.contar("sipsa_trabajos_total", evento="unido")
+            logger.debug(f"Consulta unida al trabajo en curso {fila[0][:8]}")
+            return fila[0], False
+
+        id_trabajo = uuid.uuid4().hex
+        con.execute("""INSERT INTO trabajos (id, consulta, peticion, estado, creado, actualizado)
+                       VALUES (?, ?, ?, 'en_cola', ?, ?)""",
+                    (id_trabajo, consulta, json.dumps(peticion), ahora, ahora))
+        con.execute("DELETE FROM trabajos WHERE actualizado < ?", (ahora - VIDA,))
+
+    _ejecutor().submit(_correr, id_trabajo, peticion, ejecutar)
+    metricas.contar("sipsa_trabajos_total", evento="nuevo")
+    return id_trabajo, True
+
+
+def avanzar(etapa, hechos=0, total=0):
+    """Informa el avance del trabajo que corre en este hilo (fuera de un trabajo no hace nada)"""
+    id_trabajo = getattr(_local, "trabajo", None)
+    if id_trabajo is None:
+        return
+    ahora = time.monotonic()
+    if etapa == _local.etapa and hechos != total and ahora - _local.escrito < INTERVALO_AVANCE:
+        return
+    _local.etapa, _local.escrito = etapa, ahora
+    _actualizar(id_trabajo, etapa=etapa, hechos=hechos, total=total)
+
+
+def estado(id_trabajo):
+    """Estado de un trabajo (dict con CAMPOS y segundos), o None si no existe"""
+    try:
+        with _conexion() as con:
+            fila = con.execute(f"SELECT {', '.join(CAMPOS)} FROM trabajos WHERE id = ?", (id_trabajo,)).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"No se pudo leer el trabajo {id_trabajo[:8]}: {e}")
+        return None
+    if fila is None:
+        return None
+
+    trabajo = dict(zip(CAMPOS, fila), peticion=json.loads(fila[1]))
+    ahora = time.time()
+    # Un trabajo sin noticias en VENCIDO segundos murió con su worker
+    if trabajo["estado"] in ACTIVOS and ahora - trabajo["actualizado"] > VENCIDO:
+        trabajo.update(estado="error", error="El trabajo se interrumpió; vuelva a enviar la consulta")
+    fin = ahora if trabajo["estado"] in ACTIVOS else trabajo["actualizado"]
+    trabajo["segundos"] = round(fin - trabajo["creado"], 1)
+    return trabajo
+
+
+def resultado(id_trabajo):
+    """Resultado de un trabajo terminado en este proceso, o None"""
+    with _bloqueo:
+        return _resultados.get(id_trabajo)